@@ -0,0 +1,16 @@
+"""
+Optional Numba support. Kernels decorated with njit are compiled when numba is installed and
+run as plain Python/NumPy otherwise, so numba stays an optional dependency.
+"""
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        """No-op stand-in supporting both @njit and @njit(cache=True, ...)."""
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
@@ -1,57 +1,137 @@
 from abc import ABC, abstractmethod
+import dataclasses
+import logging
 import pandas as pd
 import numpy as np
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Mapping, Sequence, Tuple, Union
+
+from .orders import OrderBatch, OrderBook
+from .fast_engine import from_orders_batch
 
 class BacktestEngine(ABC):
     """Interface for backtesting a trading strategy."""
     
-    def __init__(self, initial_cash: float):
+    def __init__(self, initial_cash: float, verbose: bool = False):
         self.initial_cash = initial_cash
+        self.verbose = verbose
+        self._logger = logging.getLogger(__name__)
     
     @abstractmethod
-    def run_backtest(self, orders: List[Dict[str, Any]], data: pd.DataFrame) -> Dict[str, Any]:
+    def run_backtest(self, orders: Union[List[Dict[str, Any]], OrderBatch, OrderBook], data: pd.DataFrame) -> Dict[str, Any]:
         """Run backtest simulation given orders and historical data."""
         pass
 
+    def _report(self, dates: pd.Index, portfolio_values: np.ndarray) -> None:
+        """Print (verbose) or debug-log the daily portfolio values. Nothing is formatted otherwise."""
+        if self.verbose:
+            for date, value in zip(dates, portfolio_values):
+                print(f"{date}: Portfolio Value - {value:.2f}")
+        elif self._logger.isEnabledFor(logging.DEBUG):
+            for date, value in zip(dates, portfolio_values):
+                self._logger.debug("%s: Portfolio Value - %.2f", date, value)
+
 # TODO: clean up refactor implementations into sep. files, e.g. equity_backtest_engine.py
 class EquityBacktestEngine(BacktestEngine):
-    """Equities (long/short) backtest engine implementation without slippage or transaction costs."""
-
-    def run_backtest(self, orders: List[Dict[str, Any]], data: pd.DataFrame) -> Dict[str, Any]:
-        cash = self.initial_cash
-        holdings = {}
-        portfolio_values = []
-        all_dates = data.index.sort_values()
-        order_index = 0
-        num_orders = len(orders)
-
-        for current_date in all_dates:
-            while order_index < num_orders and orders[order_index]['date'] == current_date:
-                order = orders[order_index]
-                ticker = order["ticker"]
-                quantity = order["quantity"]
-                price = data.at[current_date, ticker]
-
-                if order["type"] == "BUY":
-                    cost = price * quantity
-                    cash -= cost
-                    holdings[ticker] = holdings.get(ticker, 0) + quantity
-                elif order["type"] == "SELL":
-                    proceeds = price * quantity
-                    cash += proceeds
-                    holdings[ticker] = holdings.get(ticker, 0) - quantity
-
-                order_index += 1
-
-            total_value = cash
-            for h_ticker, h_quantity in holdings.items():
-                price = data.at[current_date, h_ticker]
-                position_value = price * h_quantity
-                total_value += position_value
-
-            portfolio_values.append((current_date, total_value))
-            print(f"{current_date}: Portfolio Value - {total_value:.2f}")
-
-        portfolio_values_df = pd.DataFrame(portfolio_values, columns=["Date", "Portfolio Value"]).set_index("Date")
-        return {"portfolio_values": portfolio_values_df}
\ No newline at end of file
+    """
+    Equities (long/short) backtest engine implementation without slippage or transaction costs.
+    Orders are never checked against cash or holdings: a BUY beyond the available cash runs cash
+    negative (leverage) and a SELL without holdings opens a short position.
+    """
+
+    def __init__(self, initial_cash: float, verbose: bool = False, dtype: np.dtype = np.float64):
+        """
+        `dtype` is the precision of the price and holdings matrices used for revaluation. Pass np.float32
+        to halve the memory traffic on large universes; cash and portfolio values stay float64.
+        """
+        super().__init__(initial_cash, verbose)
+        self.dtype = np.dtype(dtype)
+
+    @staticmethod
+    def _resolve_orders(order_sets: Sequence[Union[List[Dict[str, Any]], OrderBatch, OrderBook]],
+                        data: pd.DataFrame) -> Tuple[pd.DataFrame, List[OrderBook]]:
+        """Resolve each order set against `data`, then sort `data` by date and remap the books' date positions to match."""
+        order_books = [OrderBook.resolve(orders, data.index, data.columns) for orders in order_sets]
+        if not data.index.is_monotonic_increasing:
+            sort_order = data.index.argsort()
+            new_row = np.empty_like(sort_order)
+            new_row[sort_order] = np.arange(len(sort_order))
+            data = data.iloc[sort_order]
+            order_books = [dataclasses.replace(order_book, date_idx=new_row[order_book.date_idx]) for order_book in order_books]
+        return data, order_books
+
+    def run_backtest(self, orders: Union[List[Dict[str, Any]], OrderBatch, OrderBook], data: pd.DataFrame) -> Dict[str, Any]:
+        """
+        Vectorized simulation: orders are aggregated into signed quantity deltas per order date over
+        the H traded tickers, holdings are their running sum broadcast onto every trading day and the
+        portfolio value is cash plus a row-wise dot product of holdings and prices.
+        Orders may be order dicts, an OrderBatch or an OrderBook resolved against `data`. Orders dated
+        outside the data index are ignored.
+        """
+        data, (order_book,) = self._resolve_orders([orders], data)
+        prices = np.ascontiguousarray(data.to_numpy(dtype=self.dtype))
+
+        row_idx, col_idx = order_book.date_idx, order_book.ticker_idx
+        signed_qty = order_book.signed_qty
+        # cash moves only on order events, so accumulate it per order rather than over the full matrix
+        cash_flow = np.bincount(row_idx, weights=signed_qty * prices[row_idx, col_idx].astype(np.float64),
+                                minlength=len(prices))
+
+        # holdings only ever change in columns that were traded, so the book is revalued against
+        # that T x H slice instead of the whole universe
+        book_cols, book_idx = np.unique(col_idx, return_inverse=True)
+        num_held = len(book_cols)
+
+        # group orders by date: quantity deltas are aggregated over the E distinct order dates only,
+        # and searchsorted maps every trading day onto the last order date at or before it
+        # (row 0 of the event arrays is the empty book before the first order)
+        event_rows, event_idx = np.unique(row_idx, return_inverse=True)
+        event_delta = np.zeros((len(event_rows) + 1, num_held), dtype=self.dtype)
+        event_traded = np.zeros(event_delta.shape, dtype=bool)
+        np.add.at(event_delta, (event_idx + 1, book_idx), signed_qty.astype(self.dtype))
+        event_traded[event_idx + 1, book_idx] = True
+        last_event = np.searchsorted(event_rows, np.arange(len(prices)), side='right')
+
+        holdings = np.cumsum(event_delta, axis=0)[last_event]
+        # a ticker is only marked to market once it has been traded, so a missing price
+        # before its first order doesn't leak NaNs into the portfolio value
+        in_book = np.logical_or.accumulate(event_traded, axis=0)[last_event]
+        book_prices = np.where(in_book, prices[:, book_cols], self.dtype.type(0))
+
+        cash = self.initial_cash - np.cumsum(cash_flow)
+        # the row-wise dot product runs in self.dtype but is accumulated in float64
+        portfolio_values = cash + (holdings * book_prices).sum(axis=1, dtype=np.float64)
+
+        self._report(data.index, portfolio_values)
+        portfolio_values_df = pd.DataFrame({"Portfolio Value": portfolio_values}, index=data.index.rename("Date"))
+        return {"portfolio_values": portfolio_values_df}
+
+    def run_batch(self, order_sets: Union[Mapping[Any, Union[List[Dict[str, Any]], OrderBatch, OrderBook]],
+                                          Sequence[Union[List[Dict[str, Any]], OrderBatch, OrderBook]]],
+                  data: pd.DataFrame) -> pd.DataFrame:
+        """
+        Backtest K order sets (e.g. one per strategy parameter combination) against the same prices.
+        The orders are lifted into a [K, T, N] signed size array and simulated in parallel over K by
+        fast_engine.from_orders_batch, sharing one read-only price matrix.
+
+        `order_sets` is a mapping of parameter label -> orders, or a sequence of orders; returns the
+        portfolio values with one column per label (or position), the same curves run_backtest gives for
+        each order set: prices are held in self.dtype, a traded ticker without a price makes that day's
+        value NaN and an order filled at a missing price leaves it NaN from that date on.
+        """
+        labels = list(order_sets.keys()) if isinstance(order_sets, Mapping) else list(range(len(order_sets)))
+        data, order_books = self._resolve_orders(list(order_sets.values()) if isinstance(order_sets, Mapping) else order_sets, data)
+        num_bars, num_assets = data.shape
+
+        sizes = np.zeros((len(labels), num_bars, num_assets))
+        for k, order_book in enumerate(order_books):
+            sizes[k] = order_book.to_sizes(num_bars, num_assets)
+        missing = data.isna().to_numpy()
+        # the compiled kernel needs NaN-free prices: missing prices are zeroed and the values they touch voided below
+        prices = np.ascontiguousarray(data.fillna(0.0).to_numpy(dtype=self.dtype))
+
+        portfolio_values = from_orders_batch(prices, sizes, float(self.initial_cash))
+        traded = sizes != 0
+        fills_at_missing = (traded & missing).any(axis=2)
+        held_missing = (np.logical_or.accumulate(traded, axis=1) & missing).any(axis=2)
+        portfolio_values[np.logical_or.accumulate(fills_at_missing, axis=1) | held_missing] = np.nan
+        return pd.DataFrame(portfolio_values.T, index=data.index.rename("Date"), columns=labels)
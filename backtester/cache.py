@@ -1,15 +1,79 @@
 from abc import ABC, abstractmethod
+import os
 import pandas as pd
+from typing import Dict, Optional, Sequence, Union
+from yfinance import shared
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'mdq')
+
+def download_failed(tickers: Union[str, Sequence[str]], prices: Optional[Union[pd.DataFrame, pd.Series]]) -> bool:
+    """
+    Whether a yf.download result is partial or failed, and so must not be cached. yf.download doesn't raise
+    when a ticker fails or is rate-limited: it records the error in yfinance.shared._ERRORS and returns
+    all-NaN columns. `prices` is one field of the download (e.g. Adj Close), a column per ticker.
+    """
+    tickers = tickers.replace(',', ' ').split() if isinstance(tickers, str) else list(tickers)
+    if any(ticker.upper() in shared._ERRORS for ticker in tickers):
+        return True
+    if prices is None:
+        return True
+    prices = prices.to_frame() if isinstance(prices, pd.Series) else prices
+    return prices.empty or bool(prices.isna().all().any())
 
 class Cache(ABC):
     """Interface for caching frequently accessed data."""
     
     @abstractmethod
-    def get(self, key: str) -> pd.DataFrame:
-        """Retrieve data from cache."""
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        """Retrieve data from cache, or None if the key is missing."""
         pass
     
     @abstractmethod
     def set(self, key: str, value: pd.DataFrame) -> None:
         """Store data in cache."""
-        pass
\ No newline at end of file
+        pass
+
+class InMemoryCache(Cache):
+    """
+    Process-local dict cache. An optional backing cache (e.g. DiskCache) is consulted on a miss and written through on set.
+    Frames are copied on the way in and out, so a caller mutating its frame can't change what later callers get.
+    """
+
+    def __init__(self, backend: Optional[Cache] = None):
+        self._store: Dict[str, pd.DataFrame] = {}
+        self.backend = backend
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        value = self._store.get(key)
+        if value is None and self.backend is not None:
+            value = self.backend.get(key)
+            if value is not None:
+                self._store[key] = value
+        return None if value is None else value.copy()
+
+    def set(self, key: str, value: pd.DataFrame) -> None:
+        self._store[key] = value.copy()
+        if self.backend is not None:
+            self.backend.set(key, value)
+
+    def clear(self) -> None:
+        self._store.clear()
+
+class DiskCache(Cache):
+    """Parquet-backed cache storing one zstd-compressed file per key, persisted across runs."""
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.parquet")
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        return pd.read_parquet(path, engine='pyarrow')
+
+    def set(self, key: str, value: pd.DataFrame) -> None:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        value.to_parquet(self._path(key), engine='pyarrow', compression='zstd')
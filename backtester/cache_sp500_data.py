@@ -1,41 +1,146 @@
+import functools
+import hashlib
+import io
+import os
+import pickle
+import time
 import pandas as pd
+import requests
 import yfinance as yf
-import pickle
+
+try:
+    from .cache import DEFAULT_CACHE_DIR, download_failed
+except ImportError:  # run as a script from inside backtester/ (python cache_sp500_data.py); cache.py has no compiled kernels
+    from cache import DEFAULT_CACHE_DIR, download_failed
+
+SP500_WIKI_URL = 'https://en.wikipedia.org/wiki/List_of_S%26P_500_companies'
+SP500_TABLE_CACHE = os.path.join(DEFAULT_CACHE_DIR, 'sp500_constituents.pkl')
+DOWNLOAD_CHUNK_DIR = os.path.join(DEFAULT_CACHE_DIR, 'sp500_chunks')
+DOWNLOAD_CHUNK_SIZE = 50
+SP500_TABLE_TTL = 24 * 60 * 60  # seconds
+
+def fetch_sp500_table():
+    """
+    Fetch the S&P 500 constituents table from Wikipedia, parsed with lxml.
+    The table is cached in-process and on disk; a disk copy older than a day is
+    revalidated with a conditional GET (ETag / Last-Modified) before re-downloading,
+    and still served if Wikipedia can't be reached. Every call returns its own copy.
+    """
+    return _fetch_sp500_table().copy()
+
+@functools.lru_cache(maxsize=1)
+def _fetch_sp500_table():
+    cached = None
+    if os.path.exists(SP500_TABLE_CACHE):
+        with open(SP500_TABLE_CACHE, 'rb') as f:
+            cached = pickle.load(f)
+        if time.time() - os.path.getmtime(SP500_TABLE_CACHE) < SP500_TABLE_TTL:
+            return cached['table']
+
+    headers = {'User-Agent': 'millennium-data-quality/1.0'}
+    if cached is not None:
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+    try:
+        response = requests.get(SP500_WIKI_URL, headers=headers, timeout=30)
+        if response.status_code == 304 and cached is not None:
+            os.utime(SP500_TABLE_CACHE)
+            return cached['table']
+        response.raise_for_status()
+    except requests.RequestException as e:
+        if cached is None:
+            raise
+        print(f"Warning: could not refresh the S&P 500 table ({e}), using the stale cached copy")
+        return cached['table']
+
+    table = pd.read_html(io.StringIO(response.text), flavor='lxml', attrs={'id': 'constituents'})[0]
+    os.makedirs(os.path.dirname(SP500_TABLE_CACHE), exist_ok=True)
+    with open(SP500_TABLE_CACHE, 'wb') as f:
+        pickle.dump({
+            'table': table,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        }, f)
+    return table
 
 def fetch_sp500_tickers():
-    sp500_table = pd.read_html('https://en.wikipedia.org/wiki/List_of_S%26P_500_companies')[0]
+    sp500_table = fetch_sp500_table()
     tickers = sp500_table['Symbol'].tolist()
     tickers = [ticker.replace('.', '-') for ticker in tickers]
     return tickers
 
-def download_data(tickers, start_date, end_date):
-    data = yf.download(
-        tickers,
-        start=start_date,
-        end=end_date,
-        group_by='ticker',
-        auto_adjust=False,
-        threads=True # this enables parallel downloading
-    )
-    return data
+def download_data(tickers, start_date, end_date, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """
+    Download the universe in chunks of `chunk_size` tickers, checkpointing each chunk to Parquet so an
+    interrupted build resumes where it stopped instead of starting over. A chunk in which any ticker failed
+    is not checkpointed, so the next run fetches it again.
+    Chunks are fetched one after another: yf.download collects results in module-level state
+    (yfinance.shared), so concurrent calls would clobber each other. Each call still fetches its
+    tickers in parallel with threads=True.
+    """
+    os.makedirs(DOWNLOAD_CHUNK_DIR, exist_ok=True)
+    chunks = []
+    for i in range(0, len(tickers), chunk_size):
+        chunk_tickers = tickers[i:i + chunk_size]
+        key = hashlib.blake2b(repr((tuple(chunk_tickers), start_date, end_date)).encode(), digest_size=16).hexdigest()
+        path = os.path.join(DOWNLOAD_CHUNK_DIR, f'{key}.parquet')
+        if os.path.exists(path):
+            chunks.append(pd.read_parquet(path, engine='pyarrow'))
+            continue
+
+        chunk = yf.download(
+            chunk_tickers,
+            start=start_date,
+            end=end_date,
+            group_by='ticker',
+            auto_adjust=False,
+            threads=True # this enables parallel downloading
+        )
+        if not isinstance(chunk.columns, pd.MultiIndex):
+            # a single-ticker download comes back without the ticker level
+            chunk = pd.concat({chunk_tickers[0]: chunk}, axis=1)
+        prices = chunk.xs('Adj Close', level=1, axis=1) if 'Adj Close' in chunk.columns.get_level_values(1) else None
+        if not download_failed(chunk_tickers, prices):
+            chunk.to_parquet(path, engine='pyarrow', compression='zstd')
+        chunks.append(chunk)
+    return pd.concat(chunks, axis=1)
 
 def calculate_vwap(data):
-    vwap_data = {}
-    for ticker in data.columns.levels[0]:
-        adj_close = data[ticker]['Adj Close']
-        volume = data[ticker]['Volume']
-        vwap = (adj_close * volume).cumsum() / volume.cumsum()
-        ticker_df = pd.DataFrame({
-            'Adj Close': adj_close,
-            'Volume': volume,
-            'VWAP': vwap
-        })
-        vwap_data[ticker] = ticker_df
-    return vwap_data
+    """Compute cumulative VWAP for every ticker at once. Returns a wide frame with (ticker, field) columns."""
+    adj_close = data.xs('Adj Close', level=1, axis=1)
+    volume = data.xs('Volume', level=1, axis=1)
+    vwap = (adj_close * volume).cumsum() / volume.cumsum()
+    vwap_data = pd.concat({'Adj Close': adj_close, 'Volume': volume, 'VWAP': vwap}, axis=1)
+    columns = pd.MultiIndex.from_product([adj_close.columns, ['Adj Close', 'Volume', 'VWAP']])
+    return vwap_data.swaplevel(axis=1).reindex(columns=columns)
 
 def save_data(data, filename):
-    with open(filename, 'wb') as f:
-        pickle.dump(data, f)
+    """Write the wide VWAP frame as a long (Date, Ticker) Parquet table so loads can prune tickers and fields."""
+    long_data = data.stack(level=0, future_stack=True).rename_axis(['Date', 'Ticker']).reset_index()
+    long_data.to_parquet(filename, engine='pyarrow', compression='zstd', index=False)
+
+def load_data(filename, tickers=None, fields=None):
+    """
+    Load the cached Parquet store as a dict of per-ticker DataFrames indexed by date.
+    Only the requested tickers (row filter) and fields (column projection) are read from disk.
+    """
+    columns = None if fields is None else ['Date', 'Ticker', *fields]
+    filters = None if tickers is None else [('Ticker', 'in', list(tickers))]
+    long_data = pd.read_parquet(filename, engine='pyarrow', columns=columns, filters=filters)
+    return {
+        ticker: frame.drop(columns='Ticker').set_index('Date').rename_axis(columns=None)
+        for ticker, frame in long_data.groupby('Ticker', sort=False)
+    }
+
+def save_field(data, field, filename):
+    """Write one field of the wide VWAP frame as a dates x tickers Parquet table, ready to load as a price matrix."""
+    data.xs(field, level=1, axis=1).rename_axis(index='Date', columns=None).to_parquet(filename, engine='pyarrow', compression='zstd')
+
+def load_field(filename, tickers=None):
+    """Load a dates x tickers table written by save_field, reading only the requested ticker columns."""
+    return pd.read_parquet(filename, engine='pyarrow', columns=None if tickers is None else list(tickers))
 
 def main():
     tickers = fetch_sp500_tickers()
@@ -43,8 +148,11 @@ def main():
     end_date = '2024-11-20'
     data = download_data(tickers, start_date, end_date)
     vwap_data = calculate_vwap(data)
-    save_data(vwap_data, 'sp500_data.pkl')
-    print("Data has been cached and saved to sp500_data.pkl")
+    save_data(vwap_data, 'sp500_data.parquet')
+    # wide price / volume matrices for callers that only need one field across the universe
+    save_field(vwap_data, 'Adj Close', 'sp500_prices.parquet')
+    save_field(vwap_data, 'Volume', 'sp500_volumes.parquet')
+    print("Data has been cached and saved to sp500_data.parquet, sp500_prices.parquet and sp500_volumes.parquet")
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
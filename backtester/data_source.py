@@ -1,9 +1,12 @@
 from abc import ABC, abstractmethod
+import hashlib
 import pandas as pd
 import yfinance as yf
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Union
 import numpy as np
 
+from .cache import Cache, download_failed
+
 class DataSource(ABC):
     """Interface for fetching historical market data."""
     
@@ -15,10 +18,38 @@ class DataSource(ABC):
 # TODO: refactor implementations into sep. files, e.g. yahoo_finance_data_source.py
 class YahooFinanceDataSource(DataSource):
     """Implementation of DataSource using Yahoo Finance. Queries historical price data, as well as compares weighted portfolios to SPY ETF."""
-    
-    def get_historical_data(self, tickers: List[str], start_date: str, end_date: str) -> pd.DataFrame:
+
+    def __init__(self, cache: Optional[Cache] = None):
+        # e.g. InMemoryCache(backend=DiskCache()) to reuse downloads across calls and runs
+        self.cache = cache
+
+    def _download(self, tickers: Union[str, List[str]], start_date: str, end_date: str) -> pd.DataFrame:
+        """
+        yf.download wrapper that serves repeat requests for the same tickers/date range from self.cache.
+        Ranges ending today or later are still being filled in, so they are never cached, and neither is a
+        download in which any ticker failed.
+        """
+        key = None
+        cacheable = self.cache is not None and pd.Timestamp(end_date) < pd.Timestamp.today().normalize()
+        if cacheable:
+            ticker_key = tickers if isinstance(tickers, str) else tuple(tickers)
+            key = hashlib.blake2b(repr((ticker_key, start_date, end_date)).encode(), digest_size=16).hexdigest()
+            data = self.cache.get(key)
+            if data is not None:
+                return data
+
         data = yf.download(tickers, start=start_date, end=end_date, auto_adjust=False, threads=True) # newest update replaces "Close" with "Adj Close" if set auto_adjust = True
-        return data['Adj Close']
+        if cacheable and not download_failed(tickers, data.get('Adj Close')):
+            self.cache.set(key, data)
+        return data
+
+    def get_historical_data(self, tickers: List[str], start_date: str, end_date: str, dtype_downcast: bool = False) -> pd.DataFrame:
+        """Adjusted close prices; with dtype_downcast=True they are returned as float32 to halve their memory footprint."""
+        data = self._download(tickers, start_date, end_date)
+        prices = data['Adj Close']
+        if dtype_downcast:
+            prices = prices.astype(np.float32)
+        return prices
     
     def get_historical_data_with_volume(self, tickers: List[str], start_date: str, end_date: str) -> Dict[str, pd.DataFrame]:
         """Fetch historical price and volume data for given tickers and date range, organized by ticker. Function is DEPRECATED (remove)"""
@@ -90,25 +121,34 @@ class YahooFinanceDataSource(DataSource):
             return pd.Series(0.0, index=price_data.index)
             
         weights['NormalizedWeight'] = weights['Weight'] / total_weight
-        
-        weighted_portfolio = pd.Series(0.0, index=price_data.index)
-        for ticker in valid_tickers:
-            ticker_prices = price_data[ticker]
-            # Handle missing values
-            if ticker_prices.isna().any():
-                print(f"Warning: NaN values found for {ticker}, filling forward")
-                ticker_prices = ticker_prices.ffill().bfill()
-                
-            first_valid_price = ticker_prices.iloc[0]
-            if pd.isna(first_valid_price) or first_valid_price == 0:
-                print(f"Warning: Invalid first price for {ticker}, skipping")
-                continue
-                
-            normalized_prices = ticker_prices / first_valid_price
-            ticker_weight = weights.loc[weights['Ticker'] == ticker, 'NormalizedWeight'].values[0]
-            weighted_portfolio += normalized_prices * ticker_weight
-        
-        return weighted_portfolio
+        weight_map = weights.drop_duplicates('Ticker').set_index('Ticker')['NormalizedWeight']
+
+        ticker_prices = price_data[valid_tickers]
+        # Handle missing values
+        nan_tickers = ticker_prices.columns[ticker_prices.isna().any()].tolist()
+        if nan_tickers:
+            print(f"Warning: NaN values found for {', '.join(nan_tickers)}, filling forward")
+            ticker_prices = ticker_prices.ffill().bfill()
+
+        prices = ticker_prices.to_numpy(dtype=np.float64)
+        first_prices = prices[0]
+        usable = ~np.isnan(first_prices) & (first_prices != 0)
+        if not usable.all():
+            skipped = [ticker for ticker, ok in zip(valid_tickers, usable) if not ok]
+            print(f"Warning: Invalid first price for {', '.join(skipped)}, skipping")
+
+        # normalize every constituent to its first price and weight them in a single matrix-vector product
+        normalized_prices = prices[:, usable] / first_prices[usable]
+        ticker_weights = weight_map.reindex(valid_tickers).to_numpy()[usable]
+        return pd.Series(normalized_prices @ ticker_weights, index=price_data.index)
+
+    @staticmethod
+    def _pearson(x: np.ndarray, y: np.ndarray) -> float:
+        """Pearson correlation of two return arrays; NaN when either is constant or too short."""
+        if len(x) < 2:
+            return np.nan
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.corrcoef(x, y)[0, 1]
 
     def verify_spy_vs_constituents(self, spy_data: pd.Series, weighted_portfolio: pd.Series, threshold: float = 0.0001) -> Dict[str, Any]:
         """
@@ -128,11 +168,15 @@ class YahooFinanceDataSource(DataSource):
                 'error': 'Empty data provided'
             }
         
-        aligned_data = pd.concat([spy_data, weighted_portfolio], axis=1)
-        aligned_data.columns = ['SPY', 'Portfolio']
-        aligned_data = aligned_data.dropna()
-        
-        if aligned_data.empty:
+        # align once on the shared dates with a price for both series; returns are taken on the raw
+        # arrays (normalising by the first price doesn't change them)
+        dates = spy_data.index.intersection(weighted_portfolio.index)
+        spy_prices = spy_data.reindex(dates).to_numpy(dtype=np.float64)
+        portfolio_prices = weighted_portfolio.reindex(dates).to_numpy(dtype=np.float64)
+        valid = ~(np.isnan(spy_prices) | np.isnan(portfolio_prices))
+        dates, spy_prices, portfolio_prices = dates[valid], spy_prices[valid], portfolio_prices[valid]
+
+        if len(dates) == 0:
             return {
                 'within_threshold': False,
                 'max_difference': float('inf'),
@@ -142,27 +186,31 @@ class YahooFinanceDataSource(DataSource):
                 'spearman_coeff': 0.0,
                 'error': 'No overlapping dates between SPY and weighted portfolio'
             }
-        
-        norm_spy = aligned_data['SPY'] / aligned_data['SPY'].iloc[0]
-        norm_portfolio = aligned_data['Portfolio'] / aligned_data['Portfolio'].iloc[0]
-        
-        spy_returns = norm_spy.pct_change().dropna()
-        portfolio_returns = norm_portfolio.pct_change().dropna()
-        
-        combined_returns = pd.concat([spy_returns, portfolio_returns], axis=1)
-        combined_returns.columns = ['SPY', 'Portfolio']
-        combined_returns = combined_returns.dropna()
-        
-        diff = (combined_returns['SPY'] - combined_returns['Portfolio']).abs()
-        max_diff = diff.max()
-        mean_diff = diff.mean()
-        within_threshold = (diff <= threshold).all()
-        
-        pearson_coeff = combined_returns.corr(method='pearson').iloc[0, 1]
-        spearman_coeff = combined_returns.corr(method='spearman').iloc[0, 1]
 
-        worst_days = diff.nlargest(5)
-        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            spy_ret = spy_prices[1:] / spy_prices[:-1] - 1
+            portfolio_ret = portfolio_prices[1:] / portfolio_prices[:-1] - 1
+        return_dates = dates[1:]
+        # a zero price gives NaN (0/0) or inf (x/0) returns; drop them from each series and from the comparison
+        spy_finite, portfolio_finite = np.isfinite(spy_ret), np.isfinite(portfolio_ret)
+        spy_returns = pd.Series(spy_ret[spy_finite], index=return_dates[spy_finite], name='SPY')
+        portfolio_returns = pd.Series(portfolio_ret[portfolio_finite], index=return_dates[portfolio_finite], name='Portfolio')
+        both_finite = spy_finite & portfolio_finite
+        spy_ret, portfolio_ret, return_dates = spy_ret[both_finite], portfolio_ret[both_finite], return_dates[both_finite]
+
+        diff = np.abs(spy_ret - portfolio_ret)
+        max_diff = diff.max() if len(diff) else np.nan
+        mean_diff = diff.mean() if len(diff) else np.nan
+        within_threshold = bool((diff <= threshold).all())
+
+        # Spearman is Pearson on the (average-tie) ranks
+        pearson_coeff = self._pearson(spy_ret, portfolio_ret)
+        spearman_coeff = self._pearson(pd.Series(spy_ret).rank().to_numpy(), pd.Series(portfolio_ret).rank().to_numpy())
+
+        worst = np.argpartition(diff, -5)[-5:] if len(diff) > 5 else np.arange(len(diff))
+        worst = worst[np.argsort(-diff[worst], kind='stable')]
+        worst_days = pd.Series(diff[worst], index=return_dates[worst])
+
         return {
             'within_threshold': within_threshold,
             'max_difference': max_diff,
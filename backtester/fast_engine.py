@@ -0,0 +1,128 @@
+import numpy as np
+from typing import Tuple
+
+from ._njit import njit, prange
+
+# Fast path mirroring vectorbt's Portfolio.from_orders: a compiled loop over contiguous arrays that
+# returns the portfolio curve directly, for callers (e.g. parameter sweeps) that don't need the
+# order-dict API of EquityBacktestEngine. Prices must be NaN-free (ffill beforehand); the portfolio
+# kernels are compiled with fastmath. Kernels take and return plain NumPy arrays and release the GIL,
+# so the generators and engines are thin pandas adapters over them and a sweep can call them from threads.
+
+@njit(cache=True, nogil=True)
+def rolling_mean_signals(prices: np.ndarray, window: int) -> np.ndarray:
+    """
+    Mean reversion signals for a [T, N] price matrix in one pass: +1 (BUY) where the price is below its
+    `window`-bar rolling mean, -1 (SELL) where it is not, 0 while the window is incomplete (fewer than
+    `window` non-NaN prices). The rolling sums are maintained incrementally with the same Kahan
+    compensation as pandas' rolling mean, so signals match data.rolling(window).mean() exactly.
+    """
+    num_bars, num_assets = prices.shape
+    signals = np.zeros((num_bars, num_assets), dtype=np.int8)
+    nobs = np.zeros(num_assets, dtype=np.int64)
+    neg_ct = np.zeros(num_assets, dtype=np.int64)
+    same_ct = np.zeros(num_assets, dtype=np.int64)
+    sum_x = np.zeros(num_assets)
+    compensation_add = np.zeros(num_assets)
+    compensation_remove = np.zeros(num_assets)
+    prev_value = np.full(num_assets, np.nan)
+
+    for t in range(num_bars):
+        for n in range(num_assets):
+            # drop the price leaving the window
+            if t >= window:
+                val = prices[t - window, n]
+                if not np.isnan(val):
+                    nobs[n] -= 1
+                    y = -val - compensation_remove[n]
+                    total = sum_x[n] + y
+                    compensation_remove[n] = total - sum_x[n] - y
+                    sum_x[n] = total
+                    if val < 0:
+                        neg_ct[n] -= 1
+
+            val = prices[t, n]
+            if not np.isnan(val):
+                nobs[n] += 1
+                y = val - compensation_add[n]
+                total = sum_x[n] + y
+                compensation_add[n] = total - sum_x[n] - y
+                sum_x[n] = total
+                if val < 0:
+                    neg_ct[n] += 1
+                same_ct[n] = same_ct[n] + 1 if val == prev_value[n] else 1
+                prev_value[n] = val
+
+            if nobs[n] < window:
+                continue
+            mean = sum_x[n] / nobs[n]
+            if same_ct[n] >= nobs[n]:
+                mean = prev_value[n]
+            elif neg_ct[n] == 0 and mean < 0:
+                mean = 0.0
+            elif neg_ct[n] == nobs[n] and mean > 0:
+                mean = 0.0
+            signals[t, n] = 1 if val < mean else -1
+    return signals
+
+@njit(cache=True, fastmath=True, nogil=True)
+def from_orders(prices: np.ndarray, sizes: np.ndarray, init_cash: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Simulate a long/short book from a signed order-size matrix.
+
+    Parameters:
+    - prices: [T, N] float64 prices
+    - sizes: [T, N] signed share quantities traded at each bar (0 = no trade)
+    - init_cash: starting cash
+
+    Returns:
+    - (cash[T], holdings[T, N], portfolio_value[T])
+    """
+    num_bars, num_assets = prices.shape
+    cash_out = np.empty(num_bars)
+    holdings_out = np.empty((num_bars, num_assets))
+    value_out = np.empty(num_bars)
+
+    cash = init_cash
+    position = np.zeros(num_assets)
+    for t in range(num_bars):
+        value = 0.0
+        for n in range(num_assets):
+            size = sizes[t, n]
+            if size != 0.0:
+                cash -= size * prices[t, n]
+                position[n] += size
+            value += position[n] * prices[t, n]
+            holdings_out[t, n] = position[n]
+        cash_out[t] = cash
+        value_out[t] = cash + value
+    return cash_out, holdings_out, value_out
+
+@njit(cache=True, fastmath=True, parallel=True)
+def from_orders_batch(prices: np.ndarray, sizes: np.ndarray, init_cash: float) -> np.ndarray:
+    """
+    Run K independent strategies against the same prices in parallel over the leading strategy axis.
+
+    Parameters:
+    - prices: [T, N] float64 prices, shared read-only by every strategy
+    - sizes: [K, T, N] signed share quantities per strategy
+    - init_cash: starting cash of each strategy
+
+    Returns:
+    - portfolio_value[K, T]
+    """
+    num_strategies, num_bars, num_assets = sizes.shape
+    value_out = np.empty((num_strategies, num_bars))
+    for k in prange(num_strategies):
+        cash = init_cash
+        position = np.zeros(num_assets)
+        for t in range(num_bars):
+            value = 0.0
+            for n in range(num_assets):
+                size = sizes[k, t, n]
+                if size != 0.0:
+                    cash -= size * prices[t, n]
+                    position[n] += size
+                value += position[n] * prices[t, n]
+            value_out[k, t] = cash + value
+    return value_out
@@ -1,8 +1,12 @@
+import sys
+import os
+# import through the backtester package (as the tests and notebooks do), so each compiled kernel has one module name
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 import pandas as pd
-from data_source import YahooFinanceDataSource
-from order_generator import MeanReversionOrderGenerator
-from backtest_engine import EquityBacktestEngine
-from metrics import ExtendedMetrics
+from backtester.data_source import YahooFinanceDataSource
+from backtester.order_generator import MeanReversionOrderGenerator
+from backtester.backtest_engine import EquityBacktestEngine
+from backtester.metrics import ExtendedMetrics
 
 # TODO: refactor into python notebooks, this is a MEAN REV demo of the backtester as a .py file
 def main():
@@ -20,12 +24,12 @@ def main():
 
     backtest_results = backtest_engine.run_backtest(orders, data)
     portfolio_values = backtest_results["portfolio_values"]["Portfolio Value"]
-    returns = portfolio_values.pct_change().dropna()
 
     benchmark_data = data_source.get_historical_data("SPY", "2011-01-01", "2024-01-01")
     benchmark_returns = benchmark_data.pct_change().dropna()
 
-    metrics = metrics_calculator.calculate(portfolio_values, returns, benchmark_returns)
+    # returns are derived from the portfolio values inside calculate
+    metrics = metrics_calculator.calculate(portfolio_values, benchmark_returns=benchmark_returns)
     # Note: all values are annualized and assume 252 trading days in a year
     # Note: all returns are in fractional format. For example, 0.01 is 1% return
     print("Backtest Metrics:", metrics)
@@ -1,30 +1,67 @@
 from abc import ABC, abstractmethod
 import pandas as pd
 import numpy as np
-from typing import Dict
-import matplotlib.pyplot as plt
+from typing import Dict, Optional
+
+_SQRT_252 = np.float64(np.sqrt(252.0))  # annualization factor, 252 trading days in a yr
+
+def max_drawdown(portfolio_values, window: Optional[int] = None) -> float:
+    """
+    Largest peak-to-trough loss of `portfolio_values` as a (negative) fraction of the peak.
+    With `window`, peaks are only looked for in the trailing `window` observations (a D-day lookback
+    drawdown); otherwise the running max over the whole history is used. NaN values are skipped.
+    """
+    pv = np.asarray(portfolio_values, dtype=np.float64)
+    if pv.size == 0:
+        return np.nan
+    if window is None:
+        # fmax skips NaNs the same way cummax does
+        running_max = np.fmax.accumulate(pv)
+    else:
+        running_max = pd.Series(pv).rolling(window, min_periods=1).max().to_numpy()
+    return np.nanmin(pv / running_max - 1)
+
 
 class Metrics(ABC):
     """Interface for calculating portfolio metrics."""
     
     @abstractmethod
-    def calculate(self, portfolio_values: pd.Series, returns: pd.Series, benchmark_returns: pd.Series = None) -> Dict[str, float]:
-        """Calculate performance metrics from portfolio values and returns."""
+    def calculate(self, portfolio_values: pd.Series, returns: pd.Series = None, benchmark_returns: pd.Series = None) -> Dict[str, float]:
+        """Calculate performance metrics from portfolio values and returns (derived from the values if omitted)."""
         pass
 
 
 class ExtendedMetrics(Metrics):
     """Extended metrics calculator implementation."""
     
-    def calculate(self, portfolio_values: pd.Series, returns: pd.Series, benchmark_returns: pd.Series = None) -> Dict[str, float]:
+    def calculate(self, portfolio_values: pd.Series, returns: pd.Series = None, benchmark_returns: pd.Series = None) -> Dict[str, float]:
         metrics = {}
-        
-        metrics['Daily Return'] = returns.mean()
-        metrics['Cumulative Return'] = (1 + returns).prod() - 1
-        metrics['Log Return'] = np.log(1 + returns).mean()
+
+        # pull the raw arrays out once and derive every statistic from shared intermediates
+        # instead of running a separate pandas reduction per metric
+        pv = portfolio_values.to_numpy(dtype=np.float64)
+        if returns is None:
+            # simple returns straight off the value array, without a pct_change Series
+            with np.errstate(divide='ignore', invalid='ignore'):
+                r = pv[1:] / pv[:-1] - 1
+        else:
+            r = returns.to_numpy(dtype=np.float64)
+        r = r[~np.isnan(r)]
+        n = r.size
+
+        mean = r.sum() / n if n > 0 else np.nan
+        deviations = r - mean
+        std = np.sqrt(deviations @ deviations / (n - 1)) if n > 1 else np.nan
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_returns = np.log1p(r)
+        log_returns = log_returns[~np.isnan(log_returns)]
+
+        metrics['Daily Return'] = mean
+        metrics['Cumulative Return'] = np.prod(1 + r) - 1
+        metrics['Log Return'] = log_returns.mean() if log_returns.size > 0 else np.nan
 
         # volatility is the standard deviation of returns
-        metrics['Volatility'] = returns.std() * np.sqrt(252)  # annualize volatility, 252 trading days in a yr
+        metrics['Volatility'] = std * _SQRT_252
 
         # TODO: this part is buggy, need to fix
         # if benchmark_returns is not None:
@@ -33,20 +70,29 @@ class ExtendedMetrics(Metrics):
         #     metrics['Information Coefficient'] = None
 
         risk_free_rate = 0.0045  
-        excess_returns = returns - (risk_free_rate / 252)
-        # sharpe ratio is the excess return over the risk free rate divided by the volatility
-        metrics['Sharpe Ratio'] = excess_returns.mean() / excess_returns.std() * np.sqrt(252)
+        # sharpe ratio is the excess return over the risk free rate divided by the volatility.
+        # subtracting a constant doesn't change the std, so the excess series is never materialized
+        metrics['Sharpe Ratio'] = (mean - risk_free_rate / 252) * (_SQRT_252 / std)
 
-        running_max = portfolio_values.cummax()
-        drawdown = (portfolio_values / running_max) - 1
         # max drawdown is the max loss from a peak to a trough in the portfolio value
-        metrics['Max Drawdown'] = drawdown.min()
+        metrics['Max Drawdown'] = max_drawdown(pv)
 
         # val at risk (VaR) 1 day horizon. 5% quantile. this is the max loss we can expect with 95% confidence
-        metrics['VaR 5%'] = returns.quantile(0.05)
+        # linearly interpolated like pandas' quantile, but selected in O(n) with a partial sort
+        if n > 0:
+            position = 0.05 * (n - 1)
+            lower = int(position)
+            upper = min(lower + 1, n - 1)
+            partitioned = np.partition(r, [lower, upper])
+            metrics['VaR 5%'] = partitioned[lower] + (partitioned[upper] - partitioned[lower]) * (position - lower)
+        else:
+            metrics['VaR 5%'] = np.nan
         return metrics
 
     def plot_returns(self, returns: pd.Series, title: str = "Portfolio Returns"):
+        # imported here so computing metrics doesn't pay for loading matplotlib
+        import matplotlib.pyplot as plt
+
         plt.figure(figsize=(10, 6))
         returns.cumsum().plot()
         plt.title(title)
@@ -1,43 +1,81 @@
 from abc import ABC, abstractmethod
 import pandas as pd
-from typing import List, Dict, Any
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from typing import List, Dict, Tuple
+
+from ._njit import NUMBA_AVAILABLE, njit
+from .fast_engine import rolling_mean_signals
+from .orders import BUY, SELL, OrderBatch
+
+@njit(cache=True)
+def _bab_kernel(betas: np.ndarray, portfolio_value: float, decile_frac: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Numeric core of the BAB rebalance: sort the betas, take the bottom (long) and top (short) deciles
+    and size both legs for beta neutrality with equal weights within a leg.
+
+    Returns:
+    - (low_idx, low_qty, high_idx, high_qty): positions into `betas` in ascending beta order and the
+      share quantity of each order
+    """
+    num_stocks = len(betas)
+    decile_size = max(int(num_stocks * decile_frac), 1)
+    # only the two deciles need ordering: partition them out in O(N), then sort each (k log k);
+    # positions are pre-sorted so tied betas keep their input order
+    low_idx = np.sort(np.argpartition(betas, decile_size - 1)[:decile_size])
+    high_idx = np.sort(np.argpartition(betas, num_stocks - decile_size)[num_stocks - decile_size:])
+    low_idx = low_idx[np.argsort(betas[low_idx], kind='mergesort')]
+    high_idx = high_idx[np.argsort(betas[high_idx], kind='mergesort')]
+
+    avg_low_beta = betas[low_idx].mean()
+    avg_high_beta = betas[high_idx].mean()
+    low_beta_weight = avg_high_beta / (avg_low_beta + avg_high_beta)
+    high_beta_weight = avg_low_beta / (avg_low_beta + avg_high_beta)
+
+    low_qty = np.full(len(low_idx), int(portfolio_value * low_beta_weight / decile_size), dtype=np.int64)
+    high_qty = np.full(len(high_idx), int(portfolio_value * high_beta_weight / decile_size), dtype=np.int64)
+    return low_idx, low_qty, high_idx, high_qty
+
 
 class OrderGenerator(ABC):
     """Interface for generating trade orders based on a strategy."""
     
     @abstractmethod
-    def generate_orders(self, data: pd.DataFrame) -> List[Dict[str, Any]]:
+    def generate_orders(self, data: pd.DataFrame) -> OrderBatch:
         """Generate orders given historical price data."""
         pass
 
 class MeanReversionOrderGenerator(OrderGenerator):
     """Mean reversion strategy implementation with 100-day rolling window."""
-    def generate_orders(self, data: pd.DataFrame) -> List[Dict[str, Any]]:
-        orders = []
-        tickers = data.columns
-
-        for ticker in tickers:
-            ticker_data = data[ticker].to_frame(name='Adj Close')
-            ticker_data['100_day_avg'] = ticker_data['Adj Close'].rolling(window=100).mean()
-
-            for date, row in ticker_data.iterrows():
-                if pd.isna(row['100_day_avg']):
-                    continue
-                if row['Adj Close'] < row['100_day_avg']:
-                    orders.append({"date": date, "type": "BUY", "ticker": ticker, "quantity": 100})
-                else:
-                    orders.append({"date": date, "type": "SELL", "ticker": ticker, "quantity": 100})
-
-        return orders
+    def generate_orders(self, data: pd.DataFrame) -> OrderBatch:
+        # one compiled pass over the whole frame; every cell with a full 100-day window becomes an order,
+        # BUY below the average and SELL otherwise (orders are listed ticker by ticker, then by date)
+        prices = np.ascontiguousarray(data.to_numpy(dtype=np.float64))
+        if NUMBA_AVAILABLE:
+            signals = rolling_mean_signals(prices, 100)
+        else:
+            # the kernel is an element-wise loop, so without numba fall back to pandas' rolling mean
+            rolling_avg = data.rolling(window=100).mean().to_numpy(dtype=np.float64)
+            signals = np.where(np.isnan(rolling_avg), 0, np.where(prices < rolling_avg, 1, -1)).astype(np.int8)
+        cols, rows = np.nonzero(signals.T)
+
+        return OrderBatch(
+            dates=data.index[rows],
+            tickers=pd.Categorical.from_codes(cols, categories=data.columns),
+            types=np.where(signals[rows, cols] > 0, BUY, SELL).astype(np.uint8),
+            quantity=np.full(len(rows), 100, dtype=np.int64),
+        )
 
 
 class BettingAgainstBetaOrderGenerator(OrderGenerator):
     """Betting Against Beta (BAB) strategy implementation."""
     
-    def __init__(self, lookback_period: int = 60, rebalance_frequency: str = 'ME', starting_portfolio_value: float = 100000):
+    def __init__(self, lookback_period: int = 60, rebalance_frequency: str = 'ME', starting_portfolio_value: float = 100000,
+                 verbose: bool = False):
         self.lookback_period = lookback_period
         self.rebalance_frequency = rebalance_frequency
         self.starting_portfolio_value = starting_portfolio_value
+        self.verbose = verbose
     
     def calculate_beta(self, stock_returns: pd.Series, market_returns: pd.Series) -> float:
         """
@@ -48,70 +86,67 @@ class BettingAgainstBetaOrderGenerator(OrderGenerator):
         beta = covariance / market_variance
         return beta
 
-    def calculate_betas(self, data, spy_returns, date):
-        beta_values = {}
-        for ticker, df in data.items():
-            if ticker == 'SPY':
-                continue
-            stock_returns = df['Adj Close'].pct_change(fill_method=None).dropna()
-
-            combined_returns = pd.concat([stock_returns, spy_returns], axis=1, join='inner').loc[:date]
-            combined_returns = combined_returns.iloc[-self.lookback_period:]
-
-            if len(combined_returns) < self.lookback_period:
-                continue
-
-            recent_stock_returns = combined_returns.iloc[:, 0]
-            recent_spy_returns = combined_returns.iloc[:, 1]
-            beta = self.calculate_beta(recent_stock_returns, recent_spy_returns)
-            beta_values[ticker] = beta
-
-        return beta_values
-
-    def generate_orders_for_date(self, beta_values, date):
-        beta_series = pd.Series(beta_values)
-        beta_series = beta_series.dropna()
-        sorted_beta = beta_series.sort_values()
-
-        num_stocks = len(sorted_beta)
-        decile_size = max(int(num_stocks * 0.1), 1)
-        low_beta_tickers = sorted_beta.head(decile_size).index.tolist()
-        high_beta_tickers = sorted_beta.tail(decile_size).index.tolist()
-
-        avg_low_beta = beta_series[low_beta_tickers].mean()
-        avg_high_beta = beta_series[high_beta_tickers].mean()
-
-        # ensure beta neutrality with equal weights
-        low_beta_weight = avg_high_beta / (avg_low_beta + avg_high_beta)
-        high_beta_weight = avg_low_beta / (avg_low_beta + avg_high_beta)
-
-        orders = []
+    def calculate_betas(self, returns: pd.DataFrame, spy_returns: pd.Series, dates: pd.DatetimeIndex) -> List[Dict[str, float]]:
+        """
+        Betas against SPY over the last `lookback_period` returns up to each of `dates`, for every ticker
+        of the precomputed returns matrix (dates aligned with spy_returns). The lookback windows of all
+        dates are strided views of the matrix, so tickers with a complete window are handled in one
+        tensor contraction; a ticker with missing returns falls back to its last `lookback_period` valid
+        returns, and is skipped if it has fewer.
+        """
+        lookback = self.lookback_period
+        returns_values, spy_values = returns.to_numpy(), spy_returns.to_numpy()
+        ends = spy_returns.index.searchsorted(dates, side='right')
+        has_window = ends >= lookback
+        stock_windows = sliding_window_view(returns_values, lookback, axis=0)[ends[has_window] - lookback]
+        spy_windows = sliding_window_view(spy_values, lookback)[ends[has_window] - lookback]
+
+        # cov / var for every (date, ticker); the n - 1 normalisation of both cancels
+        spy_demeaned = spy_windows - spy_windows.mean(axis=-1, keepdims=True)
+        stock_demeaned = stock_windows - stock_windows.mean(axis=-1, keepdims=True)
+        betas = np.einsum('rnl,rl->rn', stock_demeaned, spy_demeaned) / np.einsum('rl,rl->r', spy_demeaned, spy_demeaned)[:, None]
+        has_beta = np.zeros((len(dates), returns.shape[1]), dtype=bool)
+        has_beta[has_window] = ~np.isnan(stock_windows).any(axis=-1)
+        all_betas = np.full(has_beta.shape, np.nan)
+        all_betas[has_window] = betas
+
+        # incomplete windows: the last `lookback` valid returns of the ticker up to each date
+        for col in np.flatnonzero(~has_beta.all(axis=0)):
+            valid_rows = np.flatnonzero(~np.isnan(returns_values[:, col]))
+            num_valid = np.searchsorted(valid_rows, ends)
+            for row in np.flatnonzero(~has_beta[:, col] & (num_valid >= lookback)):
+                rows = valid_rows[num_valid[row] - lookback:num_valid[row]]
+                stock_demeaned = returns_values[rows, col] - returns_values[rows, col].mean()
+                spy_demeaned = spy_values[rows] - spy_values[rows].mean()
+                all_betas[row, col] = (stock_demeaned @ spy_demeaned) / (spy_demeaned @ spy_demeaned)
+                has_beta[row, col] = True
+
+        tickers = returns.columns
+        return [dict(zip(tickers[has_beta[row]], all_betas[row, has_beta[row]])) for row in range(len(dates))]
+
+    def generate_orders_for_date(self, beta_values, date) -> OrderBatch:
+        beta_series = pd.Series(beta_values, dtype=np.float64).dropna()
+        if beta_series.empty:
+            return OrderBatch.concat([])
 
         # TODO: Implement position sizing based on portfolio value / parameterization for leverage to control MAX drawdown metric (sharpe should be the same)
-        # long bottom decile, short top decile of beta stocks
-        for ticker in low_beta_tickers:
-            quantity = int(self.starting_portfolio_value * low_beta_weight / decile_size)
-            orders.append({
-                "date": date,
-                "type": "BUY",
-                "ticker": ticker,
-                "quantity": quantity  
-            })
-            print(f"Buying {ticker} on {date}")
-
-        for ticker in high_beta_tickers:
-            quantity = int(self.starting_portfolio_value * high_beta_weight / decile_size)
-            orders.append({
-                "date": date,
-                "type": "SELL",
-                "ticker": ticker,
-                "quantity": quantity
-            })
-            print(f"Selling {ticker} on {date}")
-
+        # long bottom decile, short top decile of beta stocks, weighted for beta neutrality
+        low_idx, low_qty, high_idx, high_qty = _bab_kernel(beta_series.to_numpy(), float(self.starting_portfolio_value), 0.1)
+
+        # tickers stay integer codes into the beta universe and types 1-byte codes until the orders are read
+        orders = OrderBatch.from_codes(
+            date,
+            ticker_codes=np.concatenate([low_idx, high_idx]),
+            tickers=beta_series.index,
+            types=np.repeat(np.array([BUY, SELL], dtype=np.uint8), [len(low_idx), len(high_idx)]),
+            quantity=np.concatenate([low_qty, high_qty]),
+        )
+        if self.verbose:
+            # one write per rebalance date rather than one per order
+            print("\n".join(f"{'Buying' if order['type'] == 'BUY' else 'Selling'} {order['ticker']} on {date}" for order in orders))
         return orders
 
-    def generate_orders(self, data: Dict[str, pd.DataFrame]) -> List[Dict[str, Any]]:
+    def generate_orders(self, data: Dict[str, pd.DataFrame]) -> OrderBatch:
         spy_data = data.get('SPY')
         if spy_data is None:
             raise ValueError("SPY data is required for beta calculation.")
@@ -121,15 +156,24 @@ class BettingAgainstBetaOrderGenerator(OrderGenerator):
 
         start_date = spy_returns.index[self.lookback_period]
         end_date = spy_returns.index[-1]
-        rebalance_dates = pd.date_range(start=start_date, end=end_date, freq=self.rebalance_frequency)
+        # snap each calendar rebalance date (e.g. month end) to the last trading day on or before it,
+        # so orders land on dates that exist in the price data instead of weekends/holidays
+        calendar_dates = pd.date_range(start=start_date, end=end_date, freq=self.rebalance_frequency)
+        rebalance_positions = np.unique(spy_returns.index.searchsorted(calendar_dates, side='right') - 1)
+        rebalance_dates = spy_returns.index[rebalance_positions]
+
+        # compute every ticker's returns once as a dates x tickers matrix aligned with SPY's returns,
+        # instead of recomputing them per ticker on every rebalance date
+        returns = pd.DataFrame({
+            ticker: df['Adj Close'].pct_change(fill_method=None)
+            for ticker, df in data.items() if ticker != 'SPY'
+        }).reindex(spy_returns.index)
 
         all_orders = []
 
-        for date in rebalance_dates:
-            beta_values = self.calculate_betas(data, spy_returns, date)
+        for date, beta_values in zip(rebalance_dates, self.calculate_betas(returns, spy_returns, rebalance_dates)):
             if len(beta_values) < 20:
                 continue
-            orders = self.generate_orders_for_date(beta_values, date)
-            all_orders.extend(orders)
+            all_orders.append(self.generate_orders_for_date(beta_values, date))
 
-        return all_orders
\ No newline at end of file
+        return OrderBatch.concat(all_orders)
\ No newline at end of file
@@ -0,0 +1,158 @@
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+from typing import List, Dict, Any, Iterator, Sequence, Union
+
+# signed direction of each order type; unknown types are ignored
+ORDER_SIDE = {"BUY": 1.0, "SELL": -1.0}
+# order types by their 1-byte OrderBatch code
+ORDER_TYPES = ("BUY", "SELL")
+BUY, SELL = 0, 1
+
+
+@dataclass(slots=True, frozen=True)
+class Order:
+    """A single order read out of an OrderBatch; supports order['date'] / keys() like an order dict."""
+    date: pd.Timestamp
+    type: str
+    ticker: str
+    quantity: int
+
+    def keys(self):
+        return ('date', 'type', 'ticker', 'quantity')
+
+    def __getitem__(self, key: str) -> Any:
+        return getattr(self, key)
+
+
+@dataclass
+class OrderBatch:
+    """
+    Generated orders stored column-wise by label: tickers as a categorical (integer codes into a
+    shared ticker list) and types as 1-byte codes into ORDER_TYPES. Iterating or indexing yields Order
+    records that read like order dicts, so it can stand in for List[Dict[str, Any]].
+    """
+    dates: pd.DatetimeIndex
+    tickers: pd.Categorical
+    types: np.ndarray     # uint8 codes, BUY = 0 / SELL = 1
+    quantity: np.ndarray  # int64 share quantities
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    def __getitem__(self, i: int) -> Order:
+        return Order(self.dates[i], ORDER_TYPES[self.types[i]], self.tickers[i], int(self.quantity[i]))
+
+    def __iter__(self) -> Iterator[Order]:
+        for date, type_code, ticker, quantity in zip(self.dates, self.types.tolist(), self.tickers, self.quantity.tolist()):
+            yield Order(date, ORDER_TYPES[type_code], ticker, quantity)
+
+    def to_frame(self) -> pd.DataFrame:
+        """The orders as a DataFrame with categorical type and ticker columns."""
+        return pd.DataFrame({
+            "date": self.dates,
+            "type": pd.Categorical.from_codes(self.types, categories=ORDER_TYPES),
+            "ticker": self.tickers,
+            "quantity": self.quantity,
+        })
+
+    @classmethod
+    def from_codes(cls, date, ticker_codes: np.ndarray, tickers: Sequence[str], types: np.ndarray,
+                   quantity: np.ndarray) -> 'OrderBatch':
+        """Orders placed on a single `date`, with tickers given as positions into `tickers`."""
+        return cls(
+            dates=pd.DatetimeIndex(np.full(len(ticker_codes), pd.Timestamp(date).to_datetime64())),
+            tickers=pd.Categorical.from_codes(ticker_codes, categories=pd.Index(tickers)),
+            types=np.asarray(types, dtype=np.uint8),
+            quantity=np.asarray(quantity, dtype=np.int64),
+        )
+
+    @classmethod
+    def concat(cls, batches: Sequence['OrderBatch']) -> 'OrderBatch':
+        """Concatenate batches, unioning their ticker categories."""
+        if not batches:
+            return cls(pd.DatetimeIndex([]), pd.Categorical([]), np.empty(0, dtype=np.uint8), np.empty(0, dtype=np.int64))
+        return cls(
+            dates=batches[0].dates.append([batch.dates for batch in batches[1:]]),
+            tickers=union_categoricals([batch.tickers for batch in batches]),
+            types=np.concatenate([batch.types for batch in batches]),
+            quantity=np.concatenate([batch.quantity for batch in batches]),
+        )
+
+@dataclass
+class OrderBook:
+    """
+    Columnar (structure-of-arrays) orders resolved against a price frame: one contiguous array per
+    field, with dates and tickers stored as row/column positions instead of labels.
+    """
+    date_idx: np.ndarray    # int64 row positions into the price index
+    ticker_idx: np.ndarray  # int64 column positions into the price columns
+    qty: np.ndarray         # float64 share quantities
+    is_buy: np.ndarray      # bool, False for SELL
+
+    def __len__(self) -> int:
+        return len(self.qty)
+
+    @property
+    def signed_qty(self) -> np.ndarray:
+        return np.where(self.is_buy, self.qty, -self.qty)
+
+    @classmethod
+    def resolve(cls, orders: Union['OrderBook', OrderBatch, List[Dict[str, Any]]], index: pd.Index, columns: pd.Index) -> 'OrderBook':
+        """Return `orders` as an OrderBook against the given price index/columns, converting if needed."""
+        if isinstance(orders, OrderBook):
+            return orders
+        if isinstance(orders, OrderBatch):
+            return cls.from_batch(orders, index, columns)
+        return cls.from_dicts(orders, index, columns)
+
+    @classmethod
+    def from_dicts(cls, orders: List[Dict[str, Any]], index: pd.Index, columns: pd.Index) -> 'OrderBook':
+        """
+        Build an OrderBook from order dicts, resolving labels to positions with get_indexer.
+        Orders dated outside the index or with an unknown type are dropped; unknown tickers raise KeyError.
+        """
+        num_orders = len(orders)
+        date_idx = index.get_indexer(pd.to_datetime([order["date"] for order in orders]))
+        ticker_idx = columns.get_indexer([order["ticker"] for order in orders])
+        if (ticker_idx < 0).any():
+            missing = sorted({order["ticker"] for order, col in zip(orders, ticker_idx) if col < 0})
+            raise KeyError(f"No price data for tickers: {missing}")
+        qty = np.fromiter((order["quantity"] for order in orders), dtype=np.float64, count=num_orders)
+        side = np.fromiter((ORDER_SIDE.get(order["type"], 0.0) for order in orders), dtype=np.float64, count=num_orders)
+
+        valid = (date_idx >= 0) & (side != 0)
+        return cls(
+            date_idx=date_idx[valid].astype(np.int64),
+            ticker_idx=ticker_idx[valid].astype(np.int64),
+            qty=qty[valid],
+            is_buy=side[valid] > 0,
+        )
+
+    @classmethod
+    def from_batch(cls, batch: OrderBatch, index: pd.Index, columns: pd.Index) -> 'OrderBook':
+        """
+        Resolve an OrderBatch against a price frame: each distinct ticker is looked up once and its
+        position broadcast through the categorical codes. Same rules as from_dicts.
+        """
+        date_idx = index.get_indexer(batch.dates)
+        category_idx = columns.get_indexer(batch.tickers.categories)
+        ticker_idx = category_idx[batch.tickers.codes]
+        if (ticker_idx < 0).any():
+            missing = sorted(set(batch.tickers[ticker_idx < 0]))
+            raise KeyError(f"No price data for tickers: {missing}")
+
+        valid = date_idx >= 0
+        return cls(
+            date_idx=date_idx[valid].astype(np.int64),
+            ticker_idx=ticker_idx[valid].astype(np.int64),
+            qty=batch.quantity[valid].astype(np.float64),
+            is_buy=batch.types[valid] == BUY,
+        )
+
+    def to_sizes(self, num_bars: int, num_assets: int) -> np.ndarray:
+        """Dense [T, N] signed size matrix, the input format of the fast_engine kernels."""
+        sizes = np.zeros((num_bars, num_assets))
+        np.add.at(sizes, (self.date_idx, self.ticker_idx), self.signed_qty)
+        return sizes
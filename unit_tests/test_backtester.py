@@ -1,81 +1,673 @@
 import sys
 import os
+import pickle
+import subprocess
+import tempfile
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 import unittest
 from unittest.mock import patch
 import pandas as pd
 import numpy as np
+import requests
 from backtester.data_source import YahooFinanceDataSource
-from backtester.order_generator import MeanReversionOrderGenerator
+from backtester.cache import InMemoryCache
+from backtester.order_generator import MeanReversionOrderGenerator, BettingAgainstBetaOrderGenerator, _bab_kernel
 from backtester.backtest_engine import EquityBacktestEngine
+from backtester.orders import BUY, SELL, OrderBatch, OrderBook
+from backtester.fast_engine import from_orders, from_orders_batch, rolling_mean_signals
+from backtester.metrics import ExtendedMetrics, max_drawdown
+from backtester.cache_sp500_data import (calculate_vwap, save_data, load_data, save_field, load_field, fetch_sp500_table,
+                                         fetch_sp500_tickers, _fetch_sp500_table, download_data)
+
+BACKTESTER_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backtester'))
+
+# deterministic mock price path for the 100-day mean reversion test, drawn once at import
+_RNG = np.random.default_rng(0)
+_MOCK_PRICES_150 = 100.0 + np.cumsum(_RNG.standard_normal(150))
+
 
 class TestBacktesterAndOrderGenerator(unittest.TestCase):
 
-    @patch('backtester.data_source.YahooFinanceDataSource.get_historical_data')
-    def test_mean_reversion_order_generation(self, mock_get_historical_data):
+    @classmethod
+    def setUpClass(cls):
+        # single-day fixtures shared by the edge-case tests; run_backtest and generate_orders must not mutate them
+        cls.SINGLE_DAY_DATA = pd.DataFrame({'AAPL': [150]}, index=[pd.Timestamp('2023-01-01')])
+        cls.SINGLE_BUY_ORDER = [{"date": '2023-01-01', "type": "BUY", "ticker": "AAPL", "quantity": 100}]
+        cls.SINGLE_SELL_ORDER = [{"date": '2023-01-01', "type": "SELL", "ticker": "AAPL", "quantity": 50}]
+        cls._single_day_data_snapshot = cls.SINGLE_DAY_DATA.copy()
+        # uncached, so sharing it can't carry data between tests
+        cls.data_source = YahooFinanceDataSource()
+        # mock the shared instance's download once for the class; each test sets its own return_value
+        cls._patcher = patch.object(cls.data_source, 'get_historical_data')
+        cls.mock_get_historical_data = cls._patcher.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._patcher.stop()
+
+    def tearDown(self):
+        pd.testing.assert_frame_equal(self.SINGLE_DAY_DATA, self._single_day_data_snapshot)
+        self.mock_get_historical_data.reset_mock(return_value=True)
+
+    def test_mean_reversion_order_generation(self):
         # generate 100 random mock points for mean reversion 100 day window strat
         num_days = 150
         dates = pd.date_range(start='2023-01-01', periods=num_days)
         # create a price series that fluctuates around a mean to trigger buy/sell signals
-        np.random.seed(0)  #
-        prices = 100 + np.cumsum(np.random.normal(0, 1, size=num_days))
         mock_data = pd.DataFrame({
-            'AAPL': prices
+            'AAPL': _MOCK_PRICES_150
         }, index=dates)
-        mock_get_historical_data.return_value = mock_data
+        self.mock_get_historical_data.return_value = mock_data
 
-        data_source = YahooFinanceDataSource()
-        data = data_source.get_historical_data(['AAPL'], '2023-01-01', dates[-1].strftime('%Y-%m-%d'))
+        data = self.data_source.get_historical_data(['AAPL'], '2023-01-01', dates[-1].strftime('%Y-%m-%d'))
         order_generator = MeanReversionOrderGenerator()
         orders = order_generator.generate_orders(data)
 
         self.assertGreater(len(orders), 0)
         # check that orders only start after the 100th data point (since earlier ones can't compute the rolling average)
-        orders_dates = [order['date'] for order in orders]
-        self.assertTrue(all(order_date >= dates[99] for order_date in orders_dates))
+        self.assertTrue((orders.dates >= dates[99]).all())
         order_types = set(order['type'] for order in orders)
         self.assertTrue(order_types >= {'BUY', 'SELL'})
-        self.assertTrue(all(order['ticker'] == 'AAPL' for order in orders))
+        self.assertTrue((orders.tickers == 'AAPL').all())
         required_keys = {'date', 'type', 'ticker', 'quantity'}
         self.assertTrue(all(required_keys.issubset(order.keys()) for order in orders))
 
+    def test_mean_reversion_signal_kernel(self):
+        # the kernel works on the raw float64 prices only; dates are mapped back from its positions
+        dates = pd.date_range(start='2023-01-01', periods=150)
+        signals = rolling_mean_signals(_MOCK_PRICES_150.reshape(-1, 1), 100)[:, 0]
+
+        rolling_avg = pd.Series(_MOCK_PRICES_150).rolling(window=100).mean().to_numpy()
+        expected = np.where(np.isnan(rolling_avg), 0, np.where(_MOCK_PRICES_150 < rolling_avg, 1, -1))
+        np.testing.assert_array_equal(signals, expected)
+
+        orders = MeanReversionOrderGenerator().generate_orders(pd.DataFrame({'AAPL': _MOCK_PRICES_150}, index=dates))
+        self.assertTrue(orders.dates.equals(dates[np.flatnonzero(signals)]))
+
+        # several columns at once, against the signals built from data.rolling(100).mean()
+        rng = np.random.default_rng(1)
+        walk = 100.0 + np.cumsum(rng.standard_normal(300))
+        with_gaps = walk.copy()
+        with_gaps[[120, 121, 250]] = np.nan
+        flat_run = walk.copy()
+        flat_run[50:200] = 100.0
+        data = pd.DataFrame({
+            'TIES': np.tile([95.0, 105.0, 100.0, 100.0], 75),  # every window averages exactly 100
+            'FLAT': flat_run,
+            'GAPS': with_gaps,
+            'NEG': np.cumsum(rng.standard_normal(300)),  # crosses zero
+            'WALK': walk,
+        })
+        rolling_avg = data.rolling(window=100).mean().to_numpy()
+        prices = data.to_numpy()
+        expected = np.where(np.isnan(rolling_avg), 0, np.where(prices < rolling_avg, 1, -1))
+        np.testing.assert_array_equal(rolling_mean_signals(prices, 100), expected)
+        self.assertTrue((expected[99:, 0] == np.tile([1, -1, -1, -1], 75)[99:]).all())
+        self.assertTrue((prices[:, 3] < 0).any())
+
     def test_backtest_engine_insufficient_cash(self):
         backtest_engine = EquityBacktestEngine(initial_cash=5000)
-        orders = [{"date": '2023-01-01', "type": "BUY", "ticker": "AAPL", "quantity": 100}]
-        data = pd.DataFrame({
-            'AAPL': [150]
-        }, index=[pd.Timestamp('2023-01-01')])
 
-        results = backtest_engine.run_backtest(orders, data)
+        results = backtest_engine.run_backtest(self.SINGLE_BUY_ORDER, self.SINGLE_DAY_DATA)
         portfolio_values = results['portfolio_values']
-        self.assertEqual(portfolio_values.iloc[0]['Portfolio Value'], 5000)
+        self.assertEqual(portfolio_values['Portfolio Value'].iat[0], 5000)
 
     def test_backtest_engine_sell_without_holdings(self):
         backtest_engine = EquityBacktestEngine(initial_cash=10000)
-        orders = [{"date": '2023-01-01', "type": "SELL", "ticker": "AAPL", "quantity": 50}]
-        data = pd.DataFrame({
-            'AAPL': [150]
-        }, index=[pd.Timestamp('2023-01-01')])
 
-        results = backtest_engine.run_backtest(orders, data)
+        results = backtest_engine.run_backtest(self.SINGLE_SELL_ORDER, self.SINGLE_DAY_DATA)
         portfolio_values = results['portfolio_values']
-        self.assertEqual(portfolio_values.iloc[0]['Portfolio Value'], 10000)
+        self.assertEqual(portfolio_values['Portfolio Value'].iat[0], 10000)
 
-    @patch('backtester.data_source.YahooFinanceDataSource.get_historical_data')
-    def test_order_generator_with_single_data_point(self, mock_get_historical_data):
-        dates = [pd.Timestamp('2023-01-01')]
-        mock_data = pd.DataFrame({
-            'AAPL': [150]
+    def test_backtest_engine_allows_leverage_and_short_sales(self):
+        # the single-day tests above can't tell a skipped order from a filled one, so move the price a day later
+        dates = pd.date_range(start='2023-01-01', periods=2)
+        data = pd.DataFrame({'AAPL': [150, 160]}, index=dates)
+
+        # a $15,000 BUY on $1,000 of cash is filled, not skipped
+        buy = [{"date": dates[0], "type": "BUY", "ticker": "AAPL", "quantity": 100}]
+        portfolio_values = EquityBacktestEngine(initial_cash=1000).run_backtest(buy, data)['portfolio_values']
+        self.assertEqual(portfolio_values['Portfolio Value'].tolist(), [1000, 2000])
+
+        # a SELL without holdings opens a short
+        sell = [{"date": dates[0], "type": "SELL", "ticker": "AAPL", "quantity": 50}]
+        portfolio_values = EquityBacktestEngine(initial_cash=10000).run_backtest(sell, data)['portfolio_values']
+        self.assertEqual(portfolio_values['Portfolio Value'].tolist(), [10000, 9500])
+
+    def test_backtest_engine_marks_positions_to_market(self):
+        backtest_engine = EquityBacktestEngine(initial_cash=10000)
+        dates = pd.date_range(start='2023-01-02', periods=4)
+        data = pd.DataFrame({
+            'AAPL': [100, 110, 120, 90],
+            'MSFT': [200, np.nan, 210, 220]
         }, index=dates)
-        mock_get_historical_data.return_value = mock_data
+        orders = [
+            {"date": dates[0], "type": "BUY", "ticker": "AAPL", "quantity": 10},
+            {"date": dates[2], "type": "SELL", "ticker": "AAPL", "quantity": 10},
+            {"date": dates[2], "type": "BUY", "ticker": "MSFT", "quantity": 5},
+        ]
+
+        results = backtest_engine.run_backtest(orders, data)
+        portfolio_values = results['portfolio_values']['Portfolio Value']
+        # MSFT's missing price is ignored until the position is opened
+        self.assertEqual(portfolio_values.tolist(), [10000, 10100, 10200, 10250])
+
+    def test_backtest_engine_accepts_order_book(self):
+        backtest_engine = EquityBacktestEngine(initial_cash=10000)
+        dates = pd.date_range(start='2023-01-02', periods=3)
+        data = pd.DataFrame({'AAPL': [100, 110, 120]}, index=dates)
+        orders = [
+            {"date": dates[0], "type": "BUY", "ticker": "AAPL", "quantity": 10},
+            {"date": dates[1], "type": "HOLD", "ticker": "AAPL", "quantity": 10},
+            {"date": '2022-12-30', "type": "BUY", "ticker": "AAPL", "quantity": 10},
+        ]
+
+        order_book = OrderBook.from_dicts(orders, data.index, data.columns)
+        # HOLD orders and dates outside the data are dropped on conversion
+        self.assertEqual(len(order_book), 1)
+        pd.testing.assert_frame_equal(backtest_engine.run_backtest(order_book, data)['portfolio_values'],
+                                      backtest_engine.run_backtest(orders, data)['portfolio_values'])
+
+    def test_backtest_engine_accepts_order_batch(self):
+        backtest_engine = EquityBacktestEngine(initial_cash=10000)
+        dates = pd.date_range(start='2023-01-02', periods=3)
+        data = pd.DataFrame({'AAPL': [100, 110, 120], 'MSFT': [200, 210, 220]}, index=dates)
+        order_batch = OrderBatch.from_codes(dates[1], ticker_codes=np.array([1, 0]), tickers=['AAPL', 'MSFT'],
+                                            types=np.array([BUY, SELL]), quantity=np.array([5, 10]))
+
+        # the batch reads back as Order records that behave like order dicts
+        orders = list(order_batch)
+        self.assertEqual(dict(orders[0]), {"date": dates[1], "type": "BUY", "ticker": "MSFT", "quantity": 5})
+        self.assertEqual(orders[0]['ticker'], orders[0].ticker)
+        self.assertEqual(order_batch[1], orders[1])
+        self.assertEqual(order_batch.to_frame()['type'].tolist(), ['BUY', 'SELL'])
+        pd.testing.assert_frame_equal(backtest_engine.run_backtest(order_batch, data)['portfolio_values'],
+                                      backtest_engine.run_backtest(orders, data)['portfolio_values'])
+
+    def test_backtest_engine_float32_prices(self):
+        rng = np.random.default_rng(3)
+        dates = pd.bdate_range(start='2021-01-04', periods=600)
+        tickers = [f'T{i}' for i in range(8)]
+        data = pd.DataFrame(100 * np.cumprod(1 + rng.normal(0, 0.02, size=(600, 8)), axis=0), index=dates, columns=tickers)
+        orders = [
+            {"date": dates[row], "type": order_type, "ticker": tickers[col], "quantity": int(quantity)}
+            for row, order_type, col, quantity in zip(rng.integers(0, 600, 400), rng.choice(['BUY', 'SELL'], 400),
+                                                      rng.integers(0, 8, 400), rng.integers(1, 1000, 400))
+        ]
+
+        expected = EquityBacktestEngine(initial_cash=1000000).run_backtest(orders, data)['portfolio_values']['Portfolio Value']
+        portfolio_values = EquityBacktestEngine(initial_cash=1000000, dtype=np.float32).run_backtest(orders, data)['portfolio_values']['Portfolio Value']
 
-        data_source = YahooFinanceDataSource()
-        data = data_source.get_historical_data(['AAPL'], '2023-01-01', '2023-01-01')
+        # prices and holdings are float32, but cash and the portfolio curve stay float64
+        self.assertEqual(portfolio_values.dtype, np.float64)
+        # float32 carries ~7 significant digits: within $1 on a ~$1M book
+        np.testing.assert_allclose(portfolio_values.to_numpy(), expected.to_numpy(), rtol=0, atol=1.0)
+
+    def test_order_generator_with_single_data_point(self):
+        self.mock_get_historical_data.return_value = self.SINGLE_DAY_DATA
+
+        data = self.data_source.get_historical_data(['AAPL'], '2023-01-01', '2023-01-01')
         order_generator = MeanReversionOrderGenerator()
         orders = order_generator.generate_orders(data)
 
         self.assertEqual(len(orders), 0)
 
+    @patch('backtester.data_source.yf.download')
+    def test_data_source_serves_repeat_requests_from_cache(self, mock_download):
+        dates = pd.date_range(start='2023-01-01', periods=3)
+        mock_download.return_value = pd.DataFrame({
+            ('Adj Close', 'AAPL'): [150, 152, 154],
+            ('Volume', 'AAPL'): [1000, 1100, 1200]
+        }, index=dates)
+
+        data_source = YahooFinanceDataSource(cache=InMemoryCache())
+        first = data_source.get_historical_data(['AAPL'], '2023-01-01', '2023-01-04')
+        second = data_source.get_historical_data(['AAPL'], '2023-01-01', '2023-01-04')
+
+        mock_download.assert_called_once()
+        pd.testing.assert_frame_equal(first, second)
+
+        # downcasting applies to the returned prices only, the cached download keeps its dtype
+        downcast = data_source.get_historical_data(['AAPL'], '2023-01-01', '2023-01-04', dtype_downcast=True)
+        mock_download.assert_called_once()
+        self.assertTrue((downcast.dtypes == np.float32).all())
+        pd.testing.assert_frame_equal(downcast, first.astype(np.float32))
+        pd.testing.assert_frame_equal(data_source.get_historical_data(['AAPL'], '2023-01-01', '2023-01-04'), first)
+
+        # the cache hands out copies, so mutating a stored or returned frame doesn't leak into later hits
+        cache, frame = InMemoryCache(), pd.DataFrame({'AAPL': [150.0]})
+        cache.set('key', frame)
+        frame.iat[0, 0] = -1.0
+        cache.get('key').iat[0, 0] = -1.0
+        self.assertEqual(cache.get('key').iat[0, 0], 150.0)
+
+        # a range that hasn't closed yet is downloaded again rather than frozen in the cache
+        today = pd.Timestamp.today().strftime('%Y-%m-%d')
+        data_source.get_historical_data(['AAPL'], '2023-01-01', today)
+        data_source.get_historical_data(['AAPL'], '2023-01-01', today)
+        self.assertEqual(mock_download.call_count, 3)
+
+
+    @patch('backtester.data_source.yf.download')
+    def test_data_source_does_not_cache_failed_downloads(self, mock_download):
+        dates = pd.date_range(start='2023-01-01', periods=3)
+        data_source = YahooFinanceDataSource(cache=InMemoryCache())
+
+        # yfinance returns an all-NaN column for a ticker it failed to fetch instead of raising
+        mock_download.return_value = pd.DataFrame({
+            ('Adj Close', 'AAPL'): [150.0, 152.0, 154.0],
+            ('Adj Close', 'MSFT'): [np.nan, np.nan, np.nan],
+        }, index=dates)
+        data_source.get_historical_data(['AAPL', 'MSFT'], '2023-01-01', '2023-01-04')
+        data_source.get_historical_data(['AAPL', 'MSFT'], '2023-01-01', '2023-01-04')
+        self.assertEqual(mock_download.call_count, 2)
+
+        # or records the error in yfinance.shared._ERRORS
+        mock_download.return_value = pd.DataFrame({('Adj Close', 'AAPL'): [150.0, 152.0, 154.0]}, index=dates)
+        with patch.dict('yfinance.shared._ERRORS', {'AAPL': 'YFRateLimitError'}):
+            data_source.get_historical_data(['AAPL'], '2023-01-01', '2023-01-04')
+        data_source.get_historical_data(['AAPL'], '2023-01-01', '2023-01-04')
+        data_source.get_historical_data(['AAPL'], '2023-01-01', '2023-01-04')
+        self.assertEqual(mock_download.call_count, 4)
+
+
+class TestBettingAgainstBeta(unittest.TestCase):
+
+    def test_calculate_betas_matches_per_ticker_reference(self):
+        rng = np.random.default_rng(7)
+        dates = pd.bdate_range(start='2023-01-02', periods=200)
+        spy_prices = 400 * np.cumprod(1 + rng.normal(0, 0.01, size=200))
+        data = {'SPY': pd.DataFrame({'Adj Close': spy_prices}, index=dates)}
+        for i in range(6):
+            prices = 50 * np.cumprod(1 + rng.normal(0, 0.02, size=200))
+            data[f'T{i}'] = pd.DataFrame({'Adj Close': prices}, index=dates)
+        data['T1'].iloc[[40, 41, 95, 190], 0] = np.nan                    # NaN gaps
+        data['T2'] = data['T2'].drop(dates[[30, 60, 61, 62, 150]])        # missing rows
+        data['T3'] = data['T3'].iloc[120:]                                # listed late
+        data['T4'] = data['T4'].iloc[185:]                                # too short for any window
+        generator = BettingAgainstBetaOrderGenerator(lookback_period=20)
+
+        # returns as generate_orders builds them; one rebalance date falls on a weekend
+        spy_returns = data['SPY']['Adj Close'].pct_change().dropna()
+        returns = pd.DataFrame({
+            ticker: df['Adj Close'].pct_change(fill_method=None) for ticker, df in data.items() if ticker != 'SPY'
+        }).reindex(spy_returns.index)
+        rebalance_dates = pd.DatetimeIndex([dates[25], dates[70], dates[105], dates[130], pd.Timestamp('2023-08-06'), dates[-1]])
+        betas = generator.calculate_betas(returns, spy_returns, rebalance_dates)
+
+        # reference: each ticker's last `lookback_period` returns up to the date, via calculate_beta
+        for date, beta_values in zip(rebalance_dates, betas):
+            expected = {}
+            for ticker, df in data.items():
+                if ticker == 'SPY':
+                    continue
+                stock_returns = df['Adj Close'].pct_change(fill_method=None).dropna()
+                combined = pd.concat([stock_returns, spy_returns], axis=1, join='inner').loc[:date].iloc[-20:]
+                if len(combined) == 20:
+                    expected[ticker] = generator.calculate_beta(combined.iloc[:, 0], combined.iloc[:, 1])
+            self.assertEqual(sorted(beta_values), sorted(expected), msg=date)
+            for ticker, beta in expected.items():
+                self.assertAlmostEqual(beta_values[ticker], beta, places=10, msg=(date, ticker))
+        # gappy windows go through the valid-returns fallback; T3 needs 20 returns after listing
+        self.assertIn('T1', betas[2])
+        self.assertIn('T2', betas[1])
+        self.assertNotIn('T3', betas[3])
+        self.assertIn('T3', betas[4])
+        self.assertNotIn('T4', betas[-1])
+
+    def test_rebalance_dates_snap_to_trading_days(self):
+        rng = np.random.default_rng(5)
+        # 2023-03-31 is treated as an exchange holiday; 2023-04-30 is a Sunday
+        dates = pd.bdate_range(start='2023-01-02', end='2023-06-30').drop(pd.Timestamp('2023-03-31'))
+        data = {'SPY': pd.DataFrame({'Adj Close': 400 * np.cumprod(1 + rng.normal(0, 0.01, size=len(dates)))}, index=dates)}
+        for i in range(25):
+            data[f'T{i}'] = pd.DataFrame({'Adj Close': 50 * np.cumprod(1 + rng.normal(0, 0.02, size=len(dates)))}, index=dates)
+
+        orders = BettingAgainstBetaOrderGenerator(lookback_period=20).generate_orders(data)
+
+        # month ends off the calendar map to the previous trading day
+        expected_dates = pd.DatetimeIndex(['2023-01-31', '2023-02-28', '2023-03-30', '2023-04-28', '2023-05-31', '2023-06-30'])
+        self.assertTrue(orders.dates.unique().equals(expected_dates))
+
+        # every order lands on a date in the price data, so the engine executes all of them
+        prices = pd.DataFrame({ticker: df['Adj Close'] for ticker, df in data.items() if ticker != 'SPY'})
+        self.assertEqual(len(OrderBook.resolve(orders, prices.index, prices.columns)), len(orders))
+        portfolio_values = EquityBacktestEngine(initial_cash=100000).run_backtest(orders, prices)['portfolio_values']['Portfolio Value']
+        self.assertTrue((portfolio_values.loc[:'2023-01-30'] == 100000).all())
+        self.assertEqual(portfolio_values.loc['2023-02-01':].nunique(), len(portfolio_values.loc['2023-02-01':]))
+
+    def test_bab_kernel_deciles_and_sizing(self):
+        rng = np.random.default_rng(11)
+        betas = rng.permutation(np.linspace(0.2, 2.0, 25))
+
+        low_idx, low_qty, high_idx, high_qty = _bab_kernel(betas, 100000.0, 0.1)
+
+        # int(25 * 0.1) = 2 names per leg, each leg in ascending beta order
+        order = np.argsort(betas)
+        np.testing.assert_array_equal(low_idx, order[:2])
+        np.testing.assert_array_equal(high_idx, order[-2:])
+        # beta neutral: each leg is weighted by the other leg's average beta, split equally within the leg
+        avg_low, avg_high = betas[low_idx].mean(), betas[high_idx].mean()
+        np.testing.assert_array_equal(low_qty, [int(100000 * avg_high / (avg_low + avg_high) / 2)] * 2)
+        np.testing.assert_array_equal(high_qty, [int(100000 * avg_low / (avg_low + avg_high) / 2)] * 2)
+        self.assertEqual(low_qty.dtype, np.int64)
+
+        # fewer than 10 names still trades one per leg
+        low_idx, low_qty, high_idx, high_qty = _bab_kernel(np.array([1.5, 0.5, 1.0, 2.0, 0.8]), 1000.0, 0.1)
+        np.testing.assert_array_equal(low_idx, [1])
+        np.testing.assert_array_equal(high_idx, [3])
+        np.testing.assert_array_equal(low_qty, [int(1000 * 2.0 / 2.5)])
+        np.testing.assert_array_equal(high_qty, [int(1000 * 0.5 / 2.5)])
+
+    def test_bab_kernel_tied_betas(self):
+        # tied betas inside a decile keep their input order
+        betas = np.array([0.5, 1.0, 0.5, 1.2, 0.5, 1.4, 1.6, 2.0, 1.8, 2.0] + [1.1] * 20)
+        low_idx, _, high_idx, _ = _bab_kernel(betas, 100000.0, 0.1)
+        np.testing.assert_array_equal(low_idx, [0, 2, 4])
+        np.testing.assert_array_equal(high_idx, [8, 7, 9])
+
+        # ties straddling the decile boundary: which tied name is taken is unspecified, but each leg holds
+        # the right betas in ascending order and the two legs never share a name
+        betas = np.array([0.5, 0.7, 0.7, 0.7, 1.0, 1.0, 1.3, 1.3, 1.3, 1.6])
+        low_idx, _, high_idx, _ = _bab_kernel(betas, 100000.0, 0.2)
+        np.testing.assert_array_equal(betas[low_idx], [0.5, 0.7])
+        np.testing.assert_array_equal(betas[high_idx], [1.3, 1.6])
+        self.assertEqual(len(set(low_idx) | set(high_idx)), 4)
+
+
+class TestFastEngine(unittest.TestCase):
+
+    def test_from_orders_matches_equity_backtest_engine(self):
+        dates = pd.date_range(start='2023-01-02', periods=4)
+        prices = np.array([[100, 200], [110, 205], [120, 210], [90, 220]], dtype=np.float64)
+        sizes = np.array([[10, 0], [0, 0], [-10, 5], [0, -5]], dtype=np.float64)
+        orders = [
+            {"date": dates[0], "type": "BUY", "ticker": "AAPL", "quantity": 10},
+            {"date": dates[2], "type": "SELL", "ticker": "AAPL", "quantity": 10},
+            {"date": dates[2], "type": "BUY", "ticker": "MSFT", "quantity": 5},
+            {"date": dates[3], "type": "SELL", "ticker": "MSFT", "quantity": 5},
+        ]
+        data = pd.DataFrame(prices, index=dates, columns=['AAPL', 'MSFT'])
+        expected = EquityBacktestEngine(initial_cash=10000).run_backtest(orders, data)['portfolio_values']['Portfolio Value']
+
+        cash, holdings, portfolio_values = from_orders(prices, sizes, 10000.0)
+        np.testing.assert_allclose(portfolio_values, expected.to_numpy())
+        np.testing.assert_allclose(holdings, np.cumsum(sizes, axis=0))
+        self.assertEqual(cash[-1], 10000 - 1000 + 1200 - 1050 + 1100)
+
+        batch_values = from_orders_batch(prices, np.stack([sizes, np.zeros_like(sizes)]), 10000.0)
+        np.testing.assert_allclose(batch_values[0], portfolio_values)
+        np.testing.assert_allclose(batch_values[1], 10000.0)
+
+    def test_kernels_run_under_both_entry_points(self):
+        # the tests import backtester.* from the repo root; main.py and the notebooks run from inside backtester/ and
+        # put the repo root on sys.path first. Both must load the same cached kernels under the same module names
+        kernel_calls = (
+            "import numpy as np\n"
+            "from backtester.fast_engine import from_orders, from_orders_batch, rolling_mean_signals\n"
+            "from backtester.order_generator import _bab_kernel\n"
+            "rolling_mean_signals(np.ones((3, 1)), 2)\n"
+            "from_orders(np.ones((2, 1)), np.ones((2, 1)), 1.0)\n"
+            "from_orders_batch(np.ones((2, 1)), np.ones((1, 2, 1)), 1.0)\n"
+            "_bab_kernel(np.arange(1.0, 11.0), 100000.0, 0.1)\n"
+        )
+        entry_points = (
+            (os.path.dirname(BACKTESTER_DIR), "import backtester.main\n"),                             # package import
+            (BACKTESTER_DIR, "import main\n"),                                                          # python main.py
+            (BACKTESTER_DIR, "import os, sys\nsys.path.insert(0, os.path.abspath('..'))\n"),          # notebook setup
+        )
+        for cwd, setup in entry_points:
+            result = subprocess.run([sys.executable, '-c', setup + kernel_calls], cwd=cwd, capture_output=True, text=True)
+            self.assertEqual(result.returncode, 0, msg=result.stderr)
+
+    def test_run_batch_matches_run_backtest_per_parameter(self):
+        dates = pd.date_range(start='2023-01-02', periods=4)
+        data = pd.DataFrame({'AAPL': [100, 110, 120, 90], 'MSFT': [200, 205, 210, 220]}, index=dates)
+        backtest_engine = EquityBacktestEngine(initial_cash=10000)
+        order_sets = {
+            quantity: [
+                {"date": dates[0], "type": "BUY", "ticker": "AAPL", "quantity": quantity},
+                {"date": dates[2], "type": "SELL", "ticker": "AAPL", "quantity": quantity},
+                {"date": dates[2], "type": "BUY", "ticker": "MSFT", "quantity": quantity},
+            ]
+            for quantity in (1, 5, 10)
+        }
+
+        batch_values = backtest_engine.run_batch(order_sets, data)
+
+        self.assertEqual(batch_values.columns.tolist(), [1, 5, 10])
+        for quantity, orders in order_sets.items():
+            expected = backtest_engine.run_backtest(orders, data)['portfolio_values']['Portfolio Value']
+            np.testing.assert_allclose(batch_values[quantity].to_numpy(), expected.to_numpy())
+
+        # an order before the ticker's first price has no fill price, so in both paths the curve is NaN from then on
+        data = pd.DataFrame({'AAPL': [np.nan, 10, 12]}, index=dates[:3])
+        order_sets = {
+            'before_listing': [{"date": dates[0], "type": "BUY", "ticker": "AAPL", "quantity": 100}],
+            'after_listing': [{"date": dates[1], "type": "BUY", "ticker": "AAPL", "quantity": 100}],
+        }
+        backtest_engine = EquityBacktestEngine(initial_cash=1000)
+
+        batch_values = backtest_engine.run_batch(order_sets, data)
+
+        self.assertTrue(batch_values['before_listing'].isna().all())
+        self.assertEqual(batch_values['after_listing'].tolist(), [1000, 1000, 1200])
+        for label, orders in order_sets.items():
+            expected = backtest_engine.run_backtest(orders, data)['portfolio_values']['Portfolio Value']
+            np.testing.assert_allclose(batch_values[label].to_numpy(), expected.to_numpy())
+
+    def test_run_batch_matches_run_backtest_with_missing_prices(self):
+        dates = pd.date_range(start='2023-01-02', periods=6)
+        data = pd.DataFrame({
+            'AAPL': [100, np.nan, 120, 90, np.nan, 95],
+            'MSFT': [np.nan, 205, 210, np.nan, 220, 225],
+            'GOOG': [50, 51, np.nan, 53, 54, 55],  # never traded, so its gap doesn't matter
+        }, index=dates)
+        order_sets = {
+            'aapl': [{"date": dates[0], "type": "BUY", "ticker": "AAPL", "quantity": 10}],
+            'round_trip': [{"date": dates[0], "type": "BUY", "ticker": "AAPL", "quantity": 10},
+                           {"date": dates[2], "type": "SELL", "ticker": "AAPL", "quantity": 10},
+                           {"date": dates[2], "type": "BUY", "ticker": "MSFT", "quantity": 5}],
+            'fill_at_missing': [{"date": dates[1], "type": "BUY", "ticker": "AAPL", "quantity": 10}],
+        }
+
+        for dtype in (np.float64, np.float32):
+            backtest_engine = EquityBacktestEngine(initial_cash=10000, dtype=dtype)
+            batch_values = backtest_engine.run_batch(order_sets, data)
+            for label, orders in order_sets.items():
+                expected = backtest_engine.run_backtest(orders, data)['portfolio_values']['Portfolio Value']
+                np.testing.assert_allclose(batch_values[label].to_numpy(), expected.to_numpy(), rtol=1e-6, err_msg=f'{label} {dtype}')
+        # a held ticker without a price voids that day only
+        self.assertEqual(np.isnan(batch_values['aapl'].to_numpy()).tolist(), [False, True, False, False, True, False])
+
+        # order books resolved against unsorted data are remapped along with it, as in run_backtest
+        shuffled = data.iloc[[3, 0, 5, 1, 4, 2]]
+        order_book = OrderBook.from_dicts(order_sets['round_trip'], shuffled.index, shuffled.columns)
+        batch_values = backtest_engine.run_batch([order_book], shuffled)
+        expected = backtest_engine.run_backtest(order_book, shuffled)['portfolio_values']['Portfolio Value']
+        np.testing.assert_allclose(batch_values[0].to_numpy(), expected.to_numpy())
+        np.testing.assert_allclose(batch_values[0].to_numpy(), backtest_engine.run_batch([order_sets['round_trip']], data)[0].to_numpy())
+
+
+class TestExtendedMetrics(unittest.TestCase):
+
+    def test_metrics_match_pandas_reference(self):
+        np.random.seed(1)
+        dates = pd.date_range(start='2023-01-01', periods=300)
+        portfolio_values = pd.Series(100000 * np.cumprod(1 + np.random.normal(0.0005, 0.02, size=300)), index=dates)
+        returns = portfolio_values.pct_change().dropna()
+
+        metrics = ExtendedMetrics().calculate(portfolio_values, returns)
+
+        excess_returns = returns - 0.0045 / 252
+        expected = {
+            'Daily Return': returns.mean(),
+            'Cumulative Return': (1 + returns).prod() - 1,
+            'Log Return': np.log(1 + returns).mean(),
+            'Volatility': returns.std() * np.sqrt(252),
+            'Sharpe Ratio': excess_returns.mean() / excess_returns.std() * np.sqrt(252),
+            'Max Drawdown': (portfolio_values / portfolio_values.cummax() - 1).min(),
+            'VaR 5%': returns.quantile(0.05),
+        }
+        self.assertEqual(set(metrics), set(expected))
+        for name, value in expected.items():
+            self.assertAlmostEqual(metrics[name], value, places=10, msg=name)
+
+        # returns default to the portfolio values' simple returns
+        derived = ExtendedMetrics().calculate(portfolio_values)
+        for name, value in metrics.items():
+            self.assertAlmostEqual(derived[name], value, places=10, msg=name)
+
+    def test_max_drawdown_lookback_window(self):
+        portfolio_values = pd.Series([100, 80, 90, 120, 60, 70], dtype=float)
+
+        self.assertAlmostEqual(max_drawdown(portfolio_values), -0.5)
+        # with a 2-day lookback the 120 peak is still in the window for the drop to 60
+        self.assertAlmostEqual(max_drawdown(portfolio_values, window=2), -0.5)
+        # but here the 100 peak has rolled out of the window by the time the value falls to 80
+        self.assertAlmostEqual(max_drawdown([100, 90, 95, 80], window=2), 80 / 95 - 1)
+        self.assertAlmostEqual(max_drawdown([100, 90, 95, 80]), -0.2)
+
+
+class TestSPYVerification(unittest.TestCase):
+
+    def test_weighted_portfolio_matches_per_ticker_loop(self):
+        rng = np.random.default_rng(2)
+        dates = pd.bdate_range(start='2024-01-01', periods=10)
+        price_data = pd.DataFrame(100 * np.cumprod(1 + rng.normal(0, 0.01, size=(10, 5)), axis=0), index=dates,
+                                  columns=['A', 'B', 'C', 'D', 'E'])
+        price_data.iloc[[0, 4], 0] = np.nan  # missing prices, back/forward filled
+        price_data.iloc[6, 1] = np.nan
+        price_data['C'] = np.nan             # no price at all: invalid first price, skipped
+        price_data.iloc[0, 3] = 0.0          # zero first price, skipped
+        # B is listed twice and ZZZ has no prices
+        holdings_df = pd.DataFrame({'Ticker': ['A', 'B', 'C', 'D', 'E', 'B', 'ZZZ'],
+                                    'Weight': [0.3, 0.2, 0.1, 0.15, 0.15, 0.05, 0.05]})
+
+        weighted_portfolio = YahooFinanceDataSource().calculate_weighted_portfolio(holdings_df, price_data)
+
+        # reference: the original per-ticker loop
+        valid_tickers = [ticker for ticker in holdings_df['Ticker'] if ticker in price_data.columns]
+        weights = holdings_df.loc[holdings_df['Ticker'].isin(valid_tickers), ['Ticker', 'Weight']]
+        weights['NormalizedWeight'] = weights['Weight'] / weights['Weight'].sum()
+        expected = pd.Series(0.0, index=price_data.index)
+        for ticker in valid_tickers:
+            ticker_prices = price_data[ticker].ffill().bfill()
+            first_valid_price = ticker_prices.iloc[0]
+            if pd.isna(first_valid_price) or first_valid_price == 0:
+                continue
+            expected += ticker_prices / first_valid_price * weights.loc[weights['Ticker'] == ticker, 'NormalizedWeight'].values[0]
+        pd.testing.assert_series_equal(weighted_portfolio, expected)
+
+    def test_verify_spy_matches_pandas_reference(self):
+        rng = np.random.default_rng(4)
+        dates = pd.bdate_range(start='2024-01-01', periods=40)
+        spy = pd.Series(500 * np.cumprod(1 + rng.normal(0, 0.01, size=40)), index=dates, name='Adj Close')
+        portfolio = pd.Series(spy.to_numpy() * (1 + rng.normal(0, 0.001, size=40)), index=dates, name='weighted')
+        spy.iloc[7] = np.nan
+        # zero prices give a -100% return, then 0/0 (NaN) and x/0 (inf) returns
+        portfolio.iloc[[20, 21]] = 0.0
+
+        results = YahooFinanceDataSource().verify_spy_vs_constituents(spy, portfolio)
+
+        # reference: the original pandas implementation, with inf returns dropped along with NaN
+        aligned_data = pd.concat([spy, portfolio], axis=1)
+        aligned_data.columns = ['SPY', 'Portfolio']
+        aligned_data = aligned_data.dropna()
+        norm_spy = aligned_data['SPY'] / aligned_data['SPY'].iloc[0]
+        norm_portfolio = aligned_data['Portfolio'] / aligned_data['Portfolio'].iloc[0]
+        spy_returns = norm_spy.pct_change().replace([np.inf, -np.inf], np.nan).dropna()
+        portfolio_returns = norm_portfolio.pct_change().replace([np.inf, -np.inf], np.nan).dropna()
+        combined_returns = pd.concat([spy_returns, portfolio_returns], axis=1).dropna()
+        diff = (combined_returns['SPY'] - combined_returns['Portfolio']).abs()
+
+        pd.testing.assert_series_equal(results['spy_returns'], spy_returns, check_freq=False, rtol=1e-12)
+        pd.testing.assert_series_equal(results['portfolio_returns'], portfolio_returns, check_freq=False, rtol=1e-12)
+        self.assertEqual(len(combined_returns), len(aligned_data) - 3)
+        self.assertAlmostEqual(results['max_difference'], diff.max(), places=12)
+        self.assertAlmostEqual(results['mean_difference'], diff.mean(), places=12)
+        self.assertEqual(results['within_threshold'], bool((diff <= 0.0001).all()))
+        self.assertAlmostEqual(results['pearson_coeff'], combined_returns.corr(method='pearson').iloc[0, 1], places=12)
+        self.assertAlmostEqual(results['spearman_coeff'], combined_returns.corr(method='spearman').iloc[0, 1], places=12)
+        pd.testing.assert_series_equal(results['worst_days'], diff.nlargest(5), check_names=False, rtol=1e-12)
+        self.assertEqual(results['data_quality'], {'spy_nan_count': 1, 'portfolio_nan_count': 0})
+
+
+class TestSP500Cache(unittest.TestCase):
+
+    def test_sp500_table_serves_stale_copy_when_offline(self):
+        table = pd.DataFrame({'Symbol': ['AAPL', 'BRK.B'], 'Security': ['Apple Inc.', 'Berkshire Hathaway']})
+        _fetch_sp500_table.cache_clear()
+        self.addCleanup(_fetch_sp500_table.cache_clear)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'sp500_constituents.pkl')
+            with open(path, 'wb') as f:
+                pickle.dump({'table': table, 'etag': None, 'last_modified': None}, f)
+            os.utime(path, (0, 0))  # past the TTL, so it is revalidated
+            with patch('backtester.cache_sp500_data.SP500_TABLE_CACHE', path), \
+                 patch('backtester.cache_sp500_data.requests.get', side_effect=requests.ConnectionError('offline')) as mock_get:
+                first = fetch_sp500_table()
+                # callers get their own copy, so one caller's edits don't leak into the next
+                first.loc[0, 'Symbol'] = 'MSFT'
+                tickers = fetch_sp500_tickers()
+
+        mock_get.assert_called_once()
+        self.assertEqual(tickers, ['AAPL', 'BRK-B'])
+
+    @patch('backtester.cache_sp500_data.yf.download')
+    def test_failed_download_chunks_are_not_checkpointed(self, mock_download):
+        dates = pd.date_range(start='2023-01-02', periods=3)
+        good = pd.DataFrame({'Adj Close': [100.0, 101.0, 102.0], 'Volume': [10.0, 20.0, 30.0]}, index=dates)
+        # yfinance returns all-NaN columns for a ticker it failed to fetch instead of raising
+        failed = pd.DataFrame({'Adj Close': np.nan, 'Volume': np.nan}, index=dates)
+        mock_download.side_effect = [
+            pd.concat({'AAPL': good, 'MSFT': failed}, axis=1),
+            pd.concat({'GOOG': good, 'AMZN': good}, axis=1),
+            pd.concat({'AAPL': good, 'MSFT': good}, axis=1),
+        ]
+
+        with tempfile.TemporaryDirectory() as tmp_dir, patch('backtester.cache_sp500_data.DOWNLOAD_CHUNK_DIR', tmp_dir):
+            data = download_data(['AAPL', 'MSFT', 'GOOG', 'AMZN'], '2023-01-02', '2023-01-05', chunk_size=2)
+            # only the complete chunk is checkpointed
+            self.assertEqual(len(os.listdir(tmp_dir)), 1)
+            self.assertTrue(data[('MSFT', 'Adj Close')].isna().all())
+
+            # a resumed build refetches the failed chunk and reuses the good one
+            data = download_data(['AAPL', 'MSFT', 'GOOG', 'AMZN'], '2023-01-02', '2023-01-05', chunk_size=2)
+            self.assertEqual(mock_download.call_count, 3)
+            self.assertEqual(len(os.listdir(tmp_dir)), 2)
+            self.assertFalse(data[('MSFT', 'Adj Close')].isna().any())
+
+    def test_vwap_store_round_trip(self):
+        dates = pd.date_range(start='2023-01-02', periods=4)
+        # (ticker, field) columns as download_data returns them, with a missing price
+        raw = pd.concat({
+            'AAPL': pd.DataFrame({'Adj Close': [100, np.nan, 102, 103], 'Volume': [10, 20, 30, 40]}, index=dates),
+            'MSFT': pd.DataFrame({'Adj Close': [200, 201, 202, 203], 'Volume': [1, 2, 3, 4]}, index=dates),
+        }, axis=1).astype(np.float64)
+        vwap_data = calculate_vwap(raw)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'sp500_data.parquet')
+            save_data(vwap_data, path)
+
+            loaded = load_data(path)
+            self.assertEqual(sorted(loaded), ['AAPL', 'MSFT'])
+            for ticker, frame in loaded.items():
+                pd.testing.assert_frame_equal(frame, vwap_data[ticker].rename_axis('Date'), check_freq=False)
+
+            # only the requested tickers and fields are read back
+            pruned = load_data(path, tickers=['MSFT'], fields=['VWAP'])
+            self.assertEqual(list(pruned), ['MSFT'])
+            pd.testing.assert_frame_equal(pruned['MSFT'], vwap_data['MSFT'][['VWAP']].rename_axis('Date'), check_freq=False)
+
+            prices_path = os.path.join(tmp_dir, 'sp500_prices.parquet')
+            save_field(vwap_data, 'Adj Close', prices_path)
+            prices = raw.xs('Adj Close', level=1, axis=1).rename_axis('Date')
+            pd.testing.assert_frame_equal(load_field(prices_path), prices, check_freq=False)
+            pd.testing.assert_frame_equal(load_field(prices_path, tickers=['MSFT']), prices[['MSFT']], check_freq=False)
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file